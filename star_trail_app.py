@@ -10,6 +10,16 @@ import rawpy
 import imageio
 import traceback
 import platform
+import hashlib
+import io
+import json
+import uuid
+import tempfile
+import time
+import itertools
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 
 # Try to import the Sun Valley theme
 try:
@@ -18,6 +28,25 @@ except ImportError:
     print("Sun Valley theme not available. Using default theme.")
     sv_ttk = None
 
+# Optional zero-copy reader for uncompressed TIFFs
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+# Camera RAW formats decoded through LibRaw
+RAW_EXTENSIONS = ('.arw', '.cr2', '.cr3', '.nef', '.nrw', '.raf', '.dng', '.orf', '.rw2', '.pef', '.srw')
+
+# Video files accepted as an input source instead of a folder of stills
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.m4v', '.mts')
+
+# Per-user cache for master darks and other derived data
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".startrail")
+
+# Thumbnail strip slot size in pixels
+STRIP_HEIGHT = 96
+STRIP_SLOT_WIDTH = 150
+
 # Color scheme for light/dark modes
 COLOR_SCHEME = {
     "light": {
@@ -53,9 +82,18 @@ class ModernTooltip:
         self.widget.bind("<Leave>", self.hide_tooltip)
     
     def show_tooltip(self, event=None):
-        x, y, _, _ = self.widget.bbox("insert")
-        x += self.widget.winfo_rootx() + 25
-        y += self.widget.winfo_rooty() + 25
+        try:
+            box = self.widget.bbox("insert")
+        except tk.TclError:
+            box = None
+        if box:
+            x = box[0] + self.widget.winfo_rootx() + 25
+            y = box[1] + self.widget.winfo_rooty() + 25
+        elif event is not None:
+            # Canvases have no insert cursor (their bbox is None), so follow the pointer instead
+            x, y = event.x_root + 15, event.y_root + 15
+        else:
+            x, y = self.widget.winfo_rootx() + 25, self.widget.winfo_rooty() + 25
         
         # Create tooltip window
         self.tooltip_window = tk.Toplevel(self.widget)
@@ -181,6 +219,2250 @@ class CustomSwitch(ttk.Checkbutton):
         super().__init__(master, style="Switch.TCheckbutton", **kwargs)
 
 
+def normalize_frame(img, rgb=False, out=None):
+    """Bring a decoded array to BGR on the pipeline's 0-255 scale in as few passes as possible
+
+    8-bit frames are swapped in place when the buffer is writable. 16-bit
+    frames are scaled to float32 in the same pass as the channel swap, so
+    their extra precision survives into the accumulator. A matching `out`
+    array is reused for any frame that needs a new buffer.
+    """
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        rgb = False
+    elif img.shape[2] == 4:
+        img = cv2.cvtColor(img, cv2.COLOR_RGBA2BGR if rgb else cv2.COLOR_BGRA2BGR)
+        rgb = False
+    elif img.shape[2] != 3:
+        raise ValueError(f"Unsupported channel layout {img.shape}")
+    
+    if img.dtype == np.uint16:
+        fits = out is not None and out.shape == img.shape and out.dtype == np.float32
+        return np.multiply(img[:, :, ::-1] if rgb else img, 1 / 257, out=out if fits else None,
+                           dtype=np.float32)
+    if img.dtype != np.uint8:
+        raise ValueError(f"Unsupported sample type {img.dtype}")
+    if rgb:
+        if img.flags.writeable:
+            out = img
+        elif out is None or out.shape != img.shape or out.dtype != np.uint8:
+            out = None
+        img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR, dst=out)
+    return img
+
+
+class DecoderRegistry:
+    """Decoder backends per file extension, fastest first
+
+    A backend is a function (img_path, options, out=None) returning a BGR
+    frame, either uint8 or float32 on the same 0-255 scale, and may decode
+    into `out` when its size and type fit. If a backend cannot handle a
+    particular file it raises and the next one for that extension is tried.
+    Benchmark results reorder the backends and are remembered across runs.
+    """
+    
+    PREFERENCES_FILE = os.path.join(CACHE_DIR, "decoders.json")
+    
+    def __init__(self):
+        self.backends = {}  # Extension -> [(priority, name, decode)]
+        self.preferred = {}  # Extension -> name of the backend measured fastest
+        try:
+            with open(self.PREFERENCES_FILE, "r") as f:
+                self.preferred = json.load(f)
+        except (OSError, ValueError):
+            pass
+    
+    def register(self, name, extensions, priority=0, available=True):
+        """Decorator adding a backend; higher priorities are tried first until a benchmark says otherwise"""
+        def decorator(decode):
+            if available:
+                for ext in extensions:
+                    entries = self.backends.setdefault(ext.lower(), [])
+                    entries.append((priority, name, decode))
+                    entries.sort(key=lambda entry: -entry[0])
+            return decode
+        return decorator
+    
+    def extensions(self):
+        """Every extension some backend can decode"""
+        return tuple(self.backends)
+    
+    def candidates(self, img_path):
+        """Return [(name, decode)] for a file in the order they should be tried"""
+        ext = os.path.splitext(img_path)[1].lower()
+        preferred = self.preferred.get(ext)
+        entries = sorted(self.backends.get(ext, []), key=lambda entry: (entry[1] != preferred, -entry[0]))
+        return [(name, decode) for _, name, decode in entries]
+    
+    def decode(self, img_path, options, out=None):
+        """Decode a frame with the first backend that succeeds"""
+        errors = []
+        for name, decode in self.candidates(img_path):
+            try:
+                return decode(img_path, options, out)
+            except Exception as e:
+                errors.append(f"{name}: {str(e)}")
+        if not errors:
+            raise IOError(f"Unsupported image format: {img_path}")
+        raise IOError(f"Could not read image file: {img_path} ({'; '.join(errors)})")
+    
+    def benchmark(self, image_files, options, repeats=3, progress_callback=None):
+        """Time every backend on one sample per extension, prefer the fastest and return the timings
+
+        Returns {extension: [(name, seconds per frame)]} sorted fastest first.
+        Backends that cannot decode the sample, or whose frame differs in size
+        or bit depth from the default backend's, are left out.
+        """
+        samples = {}
+        for img_path in image_files:
+            samples.setdefault(os.path.splitext(img_path)[1].lower(), img_path)
+        
+        results = {}
+        for i, (ext, img_path) in enumerate(samples.items()):
+            timings = []
+            reference = None
+            for _, name, decode in self.backends.get(ext, []):
+                try:
+                    # The untimed first decode also warms the OS file cache for every backend
+                    img = decode(img_path, options)
+                    if reference is None:
+                        reference = (img.shape, img.dtype)
+                    elif (img.shape, img.dtype) != reference:
+                        continue
+                    start = time.perf_counter()
+                    for _ in range(repeats):
+                        decode(img_path, options)
+                    timings.append((name, (time.perf_counter() - start) / repeats))
+                except Exception:
+                    continue
+            timings.sort(key=lambda timing: timing[1])
+            results[ext] = timings
+            if timings:
+                self.preferred[ext] = timings[0][0]
+            if progress_callback:
+                progress_callback(i + 1, len(samples))
+        
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp_path = f"{self.PREFERENCES_FILE}.{uuid.uuid4().hex[:8]}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.preferred, f, indent=2)
+            os.replace(tmp_path, self.PREFERENCES_FILE)
+        except OSError:
+            traceback.print_exc()
+        return results
+
+
+DECODERS = DecoderRegistry()
+
+
+@DECODERS.register("libraw", RAW_EXTENSIONS, priority=10)
+def decode_libraw(img_path, options, out=None):
+    """Demosaic any LibRaw-supported RAW file with the job's RAW settings"""
+    with rawpy.imread(img_path) as raw:
+        rgb = raw.postprocess(
+            use_camera_wb=options["use_camera_wb"],
+            half_size=False,  # Full resolution
+            no_auto_bright=options["no_auto_bright"],
+            bright=1.0,  # Default brightness
+            highlight_mode=rawpy.HighlightMode.Clip  # Preserve highlights
+        )
+    return normalize_frame(rgb, rgb=True)
+
+
+@DECODERS.register("tiff-mmap", ('.tif', '.tiff'), priority=20, available=tifffile is not None)
+def decode_tiff_memmap(img_path, options, out=None):
+    """Read an uncompressed TIFF straight out of the page cache, skipping the decoder's own buffer
+
+    tifffile refuses compressed or tiled files, which then fall through to OpenCV.
+    """
+    mapped = tifffile.memmap(img_path, mode="r")
+    try:
+        return normalize_frame(mapped, rgb=True, out=out)
+    finally:
+        del mapped  # Unmap as soon as the pixels have been copied out
+
+
+_imread_into = True  # Cleared when the installed OpenCV cannot decode into an existing array
+
+
+@DECODERS.register("opencv", ('.jpg', '.jpeg', '.png', '.tif', '.tiff'), priority=10)
+def decode_opencv(img_path, options, out=None):
+    """libjpeg-turbo, libpng and libtiff through OpenCV, keeping 16-bit samples"""
+    global _imread_into
+    flags = cv2.IMREAD_COLOR | cv2.IMREAD_ANYDEPTH
+    img = None
+    if out is not None and _imread_into:
+        try:
+            # OpenCV 4.10+ decodes straight into a preallocated array of the right size
+            img = cv2.imread(img_path, dst=out, flags=flags)
+        except TypeError:
+            _imread_into = False
+        except cv2.error:
+            img = None  # This file's size or bit depth doesn't fit the buffer; decode into a new one
+    if img is None:
+        img = cv2.imread(img_path, flags)
+    if img is None:
+        raise IOError("OpenCV could not decode the file")
+    return normalize_frame(img)
+
+
+@DECODERS.register("pillow", ('.jpg', '.jpeg', '.tif', '.tiff'))
+def decode_pillow(img_path, options, out=None):
+    """Pillow fallback for 8-bit files OpenCV's codecs reject"""
+    with Image.open(img_path) as pil:
+        # Pillow reports 16-bit RGB as plain RGB and would truncate it
+        if max(getattr(pil, "tag_v2", {}).get(258, (8,)) or (8,)) > 8:
+            raise ValueError("Pillow cannot decode more than 8 bits per sample")
+        if pil.mode != "RGB":
+            pil = pil.convert("RGB")
+        img = np.array(pil)
+    return normalize_frame(img, rgb=True)
+
+
+def is_raw_file(img_path):
+    return img_path.lower().endswith(RAW_EXTENSIONS)
+
+
+class FrameBufferPool:
+    """Recycles full-size frame arrays between decodes
+
+    A fresh multi-megabyte allocation is page-faulted in on every frame;
+    decoding into a released frame of the same size skips that. Only a few
+    buffers are kept, so an idle pool holds little memory.
+    """
+    
+    def __init__(self, max_buffers=4):
+        self.max_buffers = max_buffers
+        self.free = deque()
+        self.lock = threading.Lock()
+    
+    def acquire(self, dtype=None, shape=None):
+        """Return the most recently released buffer matching dtype and shape (if given), or None"""
+        with self.lock:
+            for i in range(len(self.free) - 1, -1, -1):
+                buffer = self.free[i]
+                if (dtype is None or buffer.dtype == dtype) and (shape is None or buffer.shape == shape):
+                    del self.free[i]
+                    return buffer
+        return None
+    
+    def release(self, array):
+        """Offer a frame nobody references any more for reuse"""
+        # Views, memory maps and read-only arrays share memory with something else
+        if type(array) is not np.ndarray or array.base is not None or not array.flags.writeable:
+            return
+        with self.lock:
+            self.free.append(array)
+            while len(self.free) > self.max_buffers:
+                self.free.popleft()
+    
+    def transform(self, img, fn, dtype):
+        """Return fn(img, out) with a recycled out buffer, recycling whichever input is left unused"""
+        out = self.acquire(dtype, img.shape)
+        result = fn(img, out)
+        if result is not img:
+            self.release(img)
+        if out is not None and result is not out:
+            self.release(out)
+        return result
+    
+    def clear(self):
+        with self.lock:
+            self.free.clear()
+
+
+class DecodePool:
+    """Long-lived decode threads and frame buffers shared by every run
+
+    The threads are started and warmed up in the background at launch, so a
+    quick re-run starts decoding at once instead of spinning up a new pool.
+    Decoding stays on threads because OpenCV and LibRaw release the GIL, so
+    there are no worker processes or per-process imports to pay for. Each run
+    caps how many of the threads it occupies with its own semaphore.
+    """
+    
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 4) * 2)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="decode")
+        self.buffers = FrameBufferPool()
+        self._warmed = False
+    
+    def warm_up(self):
+        """Start every worker thread and run each codec once, without blocking the caller"""
+        if self._warmed:
+            return
+        self._warmed = True
+        sample = cv2.imencode(".jpg", np.zeros((64, 64, 3), np.uint8))[1]
+        # The barrier keeps early tasks busy so the executor has to start a thread for each one
+        barrier = threading.Barrier(self.max_workers)
+        
+        def warm():
+            cv2.imdecode(sample, cv2.IMREAD_COLOR)
+            try:
+                barrier.wait(timeout=5)
+            except threading.BrokenBarrierError:
+                pass
+        
+        for _ in range(self.max_workers):
+            self.executor.submit(warm)
+    
+    def submit(self, limiter, fn, *args):
+        """Run fn on a pool thread once the run's limiter lets it start"""
+        def task():
+            with limiter:
+                return fn(*args)
+        return self.executor.submit(task)
+
+
+DECODE_POOL = DecodePool()
+
+
+class TrailStacker:
+    """Single-pass accumulator for maximum, comet and gap-filled trails
+
+    Every mode updates the accumulator in place, so each frame costs about
+    the same as a plain maximum stack and no earlier frames are kept. Frames
+    may arrive as 8-bit or float32 BGR; only the accumulator is float32.
+    """
+
+    def __init__(self, mode="max", tail_length=30, gap_size=0, accumulator_factory=None, top_k=0,
+                 range_blocks=0, frame_count=0):
+        self.mode = mode
+        self.accumulator = None
+        self.count = 0
+        # Optional allocator for the accumulator, e.g. a memory-mapped array
+        self.accumulator_factory = accumulator_factory
+        
+        # A maximum stack can also keep its top K values per pixel for exclusion after the fact,
+        # as long as its frames are known to fit the top-K frame indices
+        self.top_k_depth = top_k if mode == "max" and 0 < frame_count <= TopKStack.MAX_FRAMES else 0
+        self.top_k = None
+        # ...and its block maxima, to stack any contiguous range of frames later
+        self.range_blocks = range_blocks if mode == "max" and frame_count > 0 else 0
+        self.frame_count = frame_count
+        self.range_tree = None
+
+        # Comet mode fades every earlier frame so that a trail drops to 1%
+        # of its brightness after `tail_length` frames
+        if mode == "comet":
+            self.decay = 0.01 ** (1.0 / max(1, int(tail_length)))
+        else:
+            self.decay = 1.0
+
+        # Gap filling closes the stack (dilate, then erode) so the short breaks
+        # between consecutive star positions are bridged without thickening trails
+        self.gap_kernel = None
+        if gap_size > 0:
+            size = 2 * int(gap_size) + 1
+            self.gap_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+
+    def add(self, frame):
+        """Fold one frame into the accumulator and return the accumulator (gaps not yet filled)"""
+        if self.top_k is not None and self.count >= TopKStack.MAX_FRAMES:
+            # A video that under-reports its length ran past the frame indices; stop tracking before stacking
+            self.top_k = None
+
+        if self.accumulator is None:
+            if self.accumulator_factory is not None:
+                self.accumulator = self.accumulator_factory(frame.shape)
+                np.copyto(self.accumulator, frame)
+            else:
+                self.accumulator = frame.astype(np.float32, copy=True)
+            # Per-pixel extras share the accumulator's storage, so they spill to disk along with it
+            if self.top_k_depth:
+                self.top_k = TopKStack(self.top_k_depth, frame.shape, self.accumulator_factory)
+            if self.range_blocks:
+                self.range_tree = RangeStackTree(self.frame_count, frame.shape, self.range_blocks,
+                                                 self.accumulator_factory)
+        else:
+            if frame.shape != self.accumulator.shape:
+                raise ValueError(f"Frame size {frame.shape[1]}x{frame.shape[0]} does not match "
+                                 f"{self.accumulator.shape[1]}x{self.accumulator.shape[0]}")
+            if self.decay < 1.0:
+                np.multiply(self.accumulator, self.decay, out=self.accumulator)
+            # 8-bit frames are widened chunk by chunk inside the ufunc, never as a whole frame
+            np.maximum(self.accumulator, frame, out=self.accumulator)
+        if self.top_k is not None:
+            self.top_k.add(frame, self.count)
+        if self.range_tree is not None:
+            self.range_tree.add(frame, self.count)
+
+        self.count += 1
+        return self.accumulator
+    
+    @staticmethod
+    def close_gaps(img, kernel):
+        """Close the gaps in a stack in place with the stacker's gap kernel, if any, and return it
+
+        Closing never darkens a pixel and closing twice changes nothing, so a
+        stack closed now and stacked further ends up exactly as if it were only
+        closed at the end. The accumulator, top-K results and range stacks may
+        therefore all be closed whenever they are shown or saved.
+        """
+        if kernel is not None:
+            cv2.morphologyEx(img, cv2.MORPH_CLOSE, kernel, dst=img)
+        return img
+
+
+class TopKStack:
+    """The K brightest values of every pixel and channel, with the frame each came from
+
+    Kept alongside a maximum stack so frames can be excluded afterwards: the
+    stack without them is the brightest remaining value at each pixel, which
+    is exact as long as fewer than K of a pixel's top values are excluded.
+    Values are uint8 and frame indices uint16, both sorted brightest first.
+    """
+    
+    NO_FRAME = np.iinfo(np.uint16).max  # Index of empty slots, so frames are numbered below it
+    MAX_FRAMES = NO_FRAME
+    CHUNK = 1 << 20  # Elements per block of the dense insert, sized to stay in cache
+    DENSE_FRACTION = 0.15  # Above this share of changed values, a dense pass beats gathering them
+    
+    def __init__(self, k, shape, allocator=None):
+        self.k = int(k)
+        allocator = allocator or (lambda shape, dtype: np.empty(shape, dtype))
+        self.values = allocator((self.k,) + tuple(shape), np.uint8)
+        self.indices = allocator((self.k,) + tuple(shape), np.uint16)
+        self.values.fill(0)
+        # Empty slots hold 0 from no frame, which is the right answer once everything above is excluded
+        self.no_frame = self.NO_FRAME
+        self.indices.fill(self.no_frame)
+    
+    def add(self, frame, index):
+        """Insert one frame wherever its values rank among the K brightest"""
+        if index >= self.no_frame:
+            raise ValueError(f"Instant exclusion supports at most {self.no_frame} frames")
+        values = self.values.reshape(self.k, -1)
+        indices = self.indices.reshape(self.k, -1)
+        frame = frame.reshape(-1)
+        
+        # Only values that beat the K-th move; late in a night that is a small fraction
+        changed = np.greater(frame, values[-1])
+        count = np.count_nonzero(changed)
+        if count > self.DENSE_FRACTION * frame.size:
+            self._insert_dense(frame, index, values, indices)
+        elif count:
+            self._insert_sparse(frame, index, values, indices, np.flatnonzero(changed))
+    
+    def _insert_sparse(self, frame, index, values, indices, positions):
+        incoming = frame[positions].astype(np.uint8)
+        incoming_index = np.full(positions.size, index, dtype=np.uint16)
+        # One insertion-sort pass down the K levels, carrying the displaced value along
+        for level in range(self.k):
+            current = values[level, positions]
+            current_index = indices[level, positions]
+            swap = incoming > current
+            values[level, positions] = np.maximum(current, incoming)
+            indices[level, positions] = np.where(swap, incoming_index, current_index)
+            incoming = np.minimum(current, incoming)
+            incoming_index = np.where(swap, current_index, incoming_index)
+    
+    def _insert_dense(self, frame, index, values, indices):
+        size = min(self.CHUNK, frame.size)
+        incoming, lower = np.empty(size, np.uint8), np.empty(size, np.uint8)
+        incoming_index, diff, mask = (np.empty(size, np.uint16) for _ in range(3))
+        swap = np.empty(size, bool)
+        
+        for start in range(0, frame.size, size):
+            stop = min(frame.size, start + size)
+            n = stop - start
+            x, low, xi = incoming[:n], lower[:n], incoming_index[:n]
+            np.copyto(x, frame[start:stop], casting="unsafe")
+            xi.fill(index)
+            for level in range(self.k):
+                v, vi = values[level, start:stop], indices[level, start:stop]
+                np.greater(x, v, out=swap[:n])
+                # Keep the larger value here and carry the smaller one down
+                np.minimum(x, v, out=low)
+                np.maximum(x, v, out=v)
+                x, low = low, x
+                # Exchange frame indices where the values swapped, branch-free
+                np.subtract(0, swap[:n].view(np.uint8), out=mask[:n], dtype=np.uint16)
+                np.bitwise_xor(vi, xi, out=diff[:n])
+                np.bitwise_and(diff[:n], mask[:n], out=diff[:n])
+                np.bitwise_xor(vi, diff[:n], out=vi)
+                np.bitwise_xor(xi, diff[:n], out=xi)
+    
+    def without(self, excluded):
+        """Return the uint8 stack without the given frame indices, and how many pixels it could not resolve
+
+        Only values whose brightest frame is excluded are revisited. An
+        unresolved pixel had all K of its stored values excluded; it keeps the
+        K-th value, which is an upper bound of the exact result.
+        """
+        excluded = np.asarray(sorted(excluded), dtype=np.uint16)
+        result = np.array(self.values[0])  # A plain in-memory copy, even of a memory map
+        if not excluded.size:
+            return result, 0
+        
+        positions = np.flatnonzero(self._matches(self.indices[0].reshape(-1), excluded))
+        if not positions.size:
+            return result, 0
+        
+        values = self.values.reshape(self.k, -1)[:, positions]
+        keep = ~self._matches(self.indices.reshape(self.k, -1)[:, positions], excluded)
+        found = keep.any(axis=0)
+        level = np.where(found, keep.argmax(axis=0), self.k - 1)
+        result.reshape(-1)[positions] = values[level, np.arange(positions.size)]
+        
+        channels = result.shape[-1] if result.ndim == 3 else 1
+        return result, int(np.unique(positions[~found] // channels).size)
+    
+    @staticmethod
+    def _matches(indices, excluded):
+        """Boolean mask of indices in excluded; a few comparisons beat np.isin's general path"""
+        if excluded.size > 8:
+            return np.isin(indices, excluded)
+        mask = indices == excluded[0]
+        for index in excluded[1:]:
+            mask |= indices == index
+        return mask
+
+
+class RangeStackTree:
+    """Segment tree of block maxima, for the maximum stack of any contiguous run of frames
+
+    Frames are grouped into equal blocks, one leaf each, and every inner node
+    holds the maximum of its two children. The stack of a range of blocks is
+    then the maximum of at most 2 log2(leaves) nodes, whatever its length.
+    Nodes are uint8 and are filled in while the frames are stacked.
+    """
+    
+    def __init__(self, frame_count, shape, leaves=16, allocator=None):
+        # Round the leaf count up to a power of two so that node i has children 2i and 2i + 1
+        self.block_size = max(1, -(-int(frame_count) // max(1, int(leaves))))
+        needed = -(-int(frame_count) // self.block_size)
+        self.leaves = 1 << max(0, needed - 1).bit_length()
+        allocator = allocator or (lambda shape, dtype: np.empty(shape, dtype))
+        # Node 0 is unused and leaves past the last frame are never written, so neither costs memory
+        self.nodes = allocator((2 * self.leaves,) + tuple(shape), np.uint8)
+        self.count = 0
+        self.sealed = 0  # Leaves whose completed ancestors are built
+    
+    def leaf_of(self, index):
+        # Frames beyond the expected count (a video that under-reports its length) extend the last leaf
+        return min(index // self.block_size, self.leaves - 1)
+    
+    def add(self, frame, index):
+        """Fold frame number `index` into its block, finishing the previous block first"""
+        leaf = self.leaf_of(index)
+        node = self.nodes[self.leaves + leaf]
+        if self.count and leaf != self.leaf_of(self.count - 1):
+            self._seal(self.leaf_of(self.count - 1))
+        if index % self.block_size == 0 and index // self.block_size == leaf:
+            np.copyto(node, frame, casting="unsafe")
+        else:
+            np.maximum(node, frame, out=node, casting="unsafe")
+        self.sealed = min(self.sealed, leaf)
+        self.count = max(self.count, index + 1)
+    
+    def _seal(self, leaf):
+        """Build every node whose last leaf is `leaf`, i.e. the ancestors reached through right children"""
+        node = self.leaves + leaf
+        while node > 1 and node & 1:
+            node >>= 1
+            np.maximum(self.nodes[2 * node], self.nodes[2 * node + 1], out=self.nodes[node])
+        self.sealed = leaf + 1
+    
+    def frame_range(self, first, last):
+        """Snap the inclusive frame range outward to whole blocks and return it"""
+        last_leaf = self.leaf_of(self.count - 1)
+        first_leaf = min(max(0, self.leaf_of(first)), last_leaf)
+        end_leaf = min(max(first_leaf, self.leaf_of(last)), last_leaf)
+        last_frame = self.count - 1 if end_leaf == last_leaf else (end_leaf + 1) * self.block_size - 1
+        return first_leaf * self.block_size, last_frame
+    
+    def stack(self, first, last):
+        """Return the uint8 maximum of frames first..last (snapped to blocks) and the range used"""
+        if not self.count:
+            raise ValueError("No frames have been stacked yet")
+        first, last = self.frame_range(first, last)
+        if self.sealed <= self.leaf_of(self.count - 1):
+            self._seal(self.leaf_of(self.count - 1))
+        
+        # Standard bottom-up walk, taking each node that lies wholly inside the range
+        lo, hi = self.leaves + self.leaf_of(first), self.leaves + self.leaf_of(last) + 1
+        taken = []
+        while lo < hi:
+            if lo & 1:
+                taken.append(lo)
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                taken.append(hi)
+            lo >>= 1
+            hi >>= 1
+        
+        result = np.array(self.nodes[taken[0]])  # A plain in-memory copy, even of a memory map
+        for node in taken[1:]:
+            np.maximum(result, self.nodes[node], out=result)
+        return result, (first, last)
+
+
+def read_capture_info(img_path):
+    """Read camera model, ISO, exposure and sensor temperature from EXIF or RAW metadata where available"""
+    info = {"camera": "unknown", "iso": None, "exposure": None, "temperature": None}
+    try:
+        with Image.open(img_path) as img:
+            exif = img.getexif()
+            info["camera"] = str(exif.get(0x0110, "unknown")).strip("\x00 ") or "unknown"
+            exif_ifd = exif.get_ifd(0x8769)
+            if 0x8827 in exif_ifd:
+                iso = exif_ifd[0x8827]
+                info["iso"] = int(iso[0] if isinstance(iso, tuple) else iso)
+            if 0x829A in exif_ifd:
+                info["exposure"] = round(float(exif_ifd[0x829A]), 4)
+            if 0x9400 in exif_ifd:
+                info["temperature"] = int(round(float(exif_ifd[0x9400])))
+    except Exception:
+        pass  # Most RAW formats aren't readable by PIL; LibRaw fills in below
+    
+    if is_raw_file(img_path):
+        try:
+            # Opening only parses the metadata; nothing is unpacked
+            with rawpy.imread(img_path) as raw:
+                other = raw.other
+                if info["iso"] is None and other.iso_speed > 0:
+                    info["iso"] = int(round(other.iso_speed))
+                if info["exposure"] is None and other.shutter_speed > 0:
+                    info["exposure"] = round(float(other.shutter_speed), 4)
+                if info["camera"] == "unknown":
+                    # rawpy doesn't expose the model, but format and sensor geometry identify the camera closely
+                    extension = os.path.splitext(img_path)[1].lower()
+                    info["camera"] = f"{extension} {raw.sizes.raw_width}x{raw.sizes.raw_height}"
+        except Exception:
+            pass  # Left unknown, so the cached master darks won't be reused blindly
+    return info
+
+
+def capture_info_known(info):
+    """Whether capture info identifies the camera settings well enough to pick a cached master dark"""
+    return info["camera"] != "unknown" and info["iso"] is not None and info["exposure"] is not None
+
+
+class DarkCalibration:
+    """Master dark and hot-pixel map applied to every decoded frame
+
+    Master darks are cached on disk keyed by camera, ISO, exposure and
+    temperature, so a dark library is only decoded once per set of settings.
+    """
+
+    HOT_PIXEL_SIGMA = 5.0
+    HOT_PIXEL_FLOOR = 16.0  # Minimum excess over the dark level, in output levels
+
+    def __init__(self, master_dark, hot_pixels):
+        self.master_dark = master_dark
+        self.hot_pixels = hot_pixels
+        self._neighbours = self._neighbour_indices(hot_pixels, master_dark.shape[:2])
+
+    @staticmethod
+    def cache_path(info):
+        """Return the cache file used for darks with the given capture info"""
+        key = json.dumps([info["camera"], info["iso"], info["exposure"], info["temperature"]])
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(CACHE_DIR, "darks", f"master_dark_{digest}.npz")
+
+    @staticmethod
+    def folder_signature(dark_files, decode_options):
+        """Fingerprint of the dark files and decode options a master was built from"""
+        entries = [decode_options]
+        for path in dark_files:
+            stat = os.stat(path)
+            entries.append([os.path.basename(path), stat.st_size, int(stat.st_mtime)])
+        return hashlib.sha1(json.dumps(entries).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def load_cached(cls, info, signature=None):
+        """Load a cached master dark, optionally requiring a matching signature"""
+        path = cls.cache_path(info)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                if signature is not None and str(data["signature"]) != signature:
+                    return None
+                return cls(data["master_dark"].astype(np.float32), data["hot_pixels"])
+        except Exception:
+            traceback.print_exc()
+            return None
+
+    @classmethod
+    def from_folder(cls, dark_folder, read_image, decode_options, progress_callback=None):
+        """Build (or load from cache) the master dark for a folder of dark frames"""
+        dark_files = sorted([os.path.join(dark_folder, f) for f in os.listdir(dark_folder)
+                             if f.lower().endswith(DECODERS.extensions())])
+        if not dark_files:
+            raise ValueError("No supported dark frames found in the dark frame folder")
+
+        info = read_capture_info(dark_files[0])
+        signature = cls.folder_signature(dark_files, decode_options)
+        cached = cls.load_cached(info, signature)
+        if cached is not None:
+            return cached
+
+        # Average the darks with a running sum so only one frame is held at a time
+        total = None
+        summed = 0
+        for i, path in enumerate(dark_files):
+            try:
+                dark = read_image(path)
+            except Exception:
+                dark = None  # Left out of the average rather than counted as a black frame
+            if dark is not None and total is None:
+                total = dark.astype(np.float32)
+                summed = 1
+            elif dark is not None and dark.shape == total.shape:
+                np.add(total, dark, out=total)
+                summed += 1
+            if progress_callback:
+                progress_callback(i + 1, len(dark_files))
+        if not summed:
+            raise ValueError("None of the dark frames could be read")
+        master_dark = total / summed
+
+        # Hot pixels stand far above the typical dark level in any channel
+        peak = master_dark.max(axis=2)
+        median = float(np.median(peak))
+        spread = 1.4826 * float(np.median(np.abs(peak - median)))
+        threshold = median + max(cls.HOT_PIXEL_SIGMA * spread, cls.HOT_PIXEL_FLOOR)
+        hot_pixels = np.flatnonzero(peak > threshold).astype(np.int64)
+
+        path = cls.cache_path(info)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # float16 halves the cache size and is exact enough for dark levels
+        tmp_path = path[:-len(".npz")] + f".{uuid.uuid4().hex[:8]}.tmp.npz"
+        np.savez(tmp_path, master_dark=master_dark.astype(np.float16), hot_pixels=hot_pixels,
+                 signature=np.array(signature))
+        os.replace(tmp_path, path)  # Concurrent jobs may build the same master
+        return cls(master_dark.astype(np.float32), hot_pixels)
+
+    @staticmethod
+    def _neighbour_indices(hot_pixels, shape):
+        """Flat indices of the 8 neighbours of every hot pixel, clamped at the borders"""
+        height, width = shape
+        ys, xs = np.divmod(hot_pixels, width)
+        offsets = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+        ny = np.clip(ys[:, None] + np.array([o[0] for o in offsets]), 0, height - 1)
+        nx = np.clip(xs[:, None] + np.array([o[1] for o in offsets]), 0, width - 1)
+        return ny * width + nx
+
+    def apply(self, img, out=None):
+        """Subtract the master dark and repair hot pixels, returning a float32 frame
+
+        Float32 frames are calibrated in place; 8-bit frames are widened by the
+        subtraction itself (into `out`, if given) rather than by a separate conversion.
+        """
+        if img.shape != self.master_dark.shape:
+            return img
+        if img.dtype == np.float32:
+            out = img
+        img = np.subtract(img, self.master_dark, out=out, dtype=np.float32)
+        np.maximum(img, 0, out=img)
+        if self.hot_pixels.size:
+            flat = img.reshape(-1, img.shape[2])
+            flat[self.hot_pixels] = np.median(flat[self._neighbours], axis=1)
+        return img
+
+
+def reduced_decode_flag(full_size, max_size, color=False):
+    """Pick the coarsest libjpeg reduced decode that still yields at least max_size pixels"""
+    for factor, color_flag, gray_flag in ((8, cv2.IMREAD_REDUCED_COLOR_8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+                                          (4, cv2.IMREAD_REDUCED_COLOR_4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+                                          (2, cv2.IMREAD_REDUCED_COLOR_2, cv2.IMREAD_REDUCED_GRAYSCALE_2)):
+        if max(full_size) // factor >= max_size:
+            return color_flag if color else gray_flag
+    return cv2.IMREAD_COLOR if color else cv2.IMREAD_GRAYSCALE
+
+
+def load_thumbnail(img_path, max_size=256, color=False):
+    """Decode a small version of a frame, avoiding a full-resolution decode
+
+    RAW files use their embedded preview and JPEGs use libjpeg's reduced
+    (DCT-scaled) decode. Other formats have no reduced path and are shrunk
+    right after decoding. Color thumbnails are BGR, like every other frame.
+    """
+    img = None
+    if is_raw_file(img_path):
+        with rawpy.imread(img_path) as raw:
+            try:
+                thumb = raw.extract_thumb()
+            except (rawpy.LibRawNoThumbnailError, rawpy.LibRawUnsupportedThumbnailError):
+                thumb = None
+            if thumb is not None and thumb.format == rawpy.ThumbFormat.JPEG:
+                thumb_size = Image.open(io.BytesIO(thumb.data)).size  # Header only
+                img = cv2.imdecode(np.frombuffer(thumb.data, np.uint8),
+                                   reduced_decode_flag(thumb_size, max_size, color))
+            else:
+                rgb = thumb.data if thumb is not None else raw.postprocess(half_size=True)
+                img = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR if color else cv2.COLOR_RGB2GRAY)
+    else:
+        with Image.open(img_path) as header:
+            full_size = header.size
+        img = cv2.imread(img_path, reduced_decode_flag(full_size, max_size, color))
+    
+    if img is None:
+        raise IOError(f"Could not read image file: {img_path}")
+    
+    scale = max_size / max(img.shape[:2])
+    if scale < 1:
+        img = cv2.resize(img, (int(img.shape[1] * scale), int(img.shape[0] * scale)),
+                         interpolation=cv2.INTER_AREA)
+    return img
+
+
+class ThumbnailCache:
+    """On-disk cache of color thumbnails, keyed by file path, size and modification time"""
+    
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.folder = os.path.join(CACHE_DIR, "thumbnails")
+    
+    def cache_path(self, img_path):
+        stat = os.stat(img_path)
+        key = f"{os.path.abspath(img_path)}|{stat.st_size}|{stat.st_mtime_ns}|{self.max_size}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.folder, digest[:2], digest + ".jpg")
+    
+    def load(self, img_path):
+        """Return the BGR thumbnail for a frame, decoding and caching it on a miss"""
+        cache_path = self.cache_path(img_path)
+        img = cv2.imread(cache_path) if os.path.exists(cache_path) else None
+        if img is None:
+            img = load_thumbnail(img_path, self.max_size, color=True)
+            try:
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                cv2.imwrite(cache_path, img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+            except (OSError, cv2.error):
+                traceback.print_exc()  # A read-only cache only costs speed
+        return img
+
+
+class FrameAnalyzer:
+    """Flags aircraft, cloud and headlight frames from thumbnail statistics"""
+    
+    STREAK_LEVEL = 25  # Brightness jump over neighbouring frames that counts as a streak pixel
+    
+    def __init__(self, threshold=4.0, max_size=256, workers=None):
+        self.threshold = threshold
+        self.cache = ThumbnailCache(max_size)
+        self.workers = workers or os.cpu_count() or 4
+    
+    def load_gray(self, img_path):
+        return cv2.cvtColor(self.cache.load(img_path), cv2.COLOR_BGR2GRAY)
+    
+    def analyze(self, image_files, progress_callback=None):
+        """Return per-frame statistics and outlier flags for a sequence of images"""
+        thumbs = [None] * len(image_files)
+        done = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.load_gray, path): i
+                       for i, path in enumerate(image_files)}
+            for future in as_completed(futures):
+                try:
+                    thumbs[futures[future]] = future.result()
+                except Exception as e:
+                    print(f"Thumbnail error: {str(e)}")
+                done += 1
+                if progress_callback:
+                    progress_callback(done, len(image_files))
+        
+        # Bring every thumbnail to a common size so frames can be compared pixel by pixel
+        valid = [t for t in thumbs if t is not None]
+        if not valid:
+            return []
+        height, width = valid[0].shape[:2]
+        stack = np.zeros((len(image_files), height, width), dtype=np.uint8)
+        for i, thumb in enumerate(thumbs):
+            if thumb is not None:
+                stack[i] = thumb if thumb.shape == (height, width) else cv2.resize(
+                    thumb, (width, height), interpolation=cv2.INTER_AREA)
+        
+        brightness = stack.mean(axis=(1, 2))
+        background = np.median(stack.reshape(len(stack), -1), axis=1)
+        
+        # Streaks are pixels that jump well above the same pixel in neighbouring frames
+        streak = np.zeros(len(stack))
+        for i in range(len(stack)):
+            neighbours = [j for j in (i - 2, i - 1, i + 1, i + 2) if 0 <= j < len(stack)]
+            if not neighbours:
+                continue
+            reference = np.median(stack[neighbours], axis=0)
+            streak[i] = np.count_nonzero(stack[i] > reference + self.STREAK_LEVEL) / stack[i].size
+        
+        z_brightness = self._robust_z(brightness)
+        z_background = self._robust_z(background)
+        z_streak = self._robust_z(streak)
+        
+        results = []
+        for i, path in enumerate(image_files):
+            flags = []
+            if thumbs[i] is None:
+                flags.append("unreadable")
+            if z_background[i] > self.threshold:
+                flags.append("clouds / sky glow")
+            elif z_brightness[i] > self.threshold:
+                flags.append("bright flash / headlights")
+            if z_streak[i] > self.threshold and streak[i] > 0.0005:
+                flags.append("streak / aircraft")
+            results.append({
+                "path": path,
+                "brightness": float(brightness[i]),
+                "background": float(background[i]),
+                "streak": float(streak[i]),
+                "flags": flags,
+            })
+        return results
+    
+    @staticmethod
+    def _robust_z(values):
+        """Median/MAD z-scores, so a handful of bad frames cannot hide themselves"""
+        median = np.median(values)
+        spread = 1.4826 * np.median(np.abs(values - median))
+        return (values - median) / max(spread, 1e-6)
+
+
+class PreviewPyramid:
+    """Multi-resolution tile pyramid of the stack, used for the zoomable preview
+
+    Each update only rewrites the base tiles whose pixels changed and rebuilds
+    their parents, so renderers can keep every untouched tile they cached.
+    """
+    
+    TILE_SIZE = 256
+    
+    def __init__(self):
+        self.levels = []  # RGB uint8 images, ready for PhotoImage; level 0 at full resolution
+        self.versions = {}  # (level, tx, ty) -> change counter
+        self.lock = threading.Lock()
+    
+    @property
+    def shape(self):
+        return self.levels[0].shape[:2] if self.levels else None
+    
+    def _allocate(self, height, width):
+        self.levels = []
+        self.versions = {}
+        while True:
+            self.levels.append(np.zeros((height, width, 3), dtype=np.uint8))
+            if max(height, width) <= self.TILE_SIZE:
+                break
+            height, width = (height + 1) // 2, (width + 1) // 2
+    
+    def update(self, img):
+        """Refresh the pyramid from a BGR stack image (uint8 or float) and return the changed base tiles
+
+        Levels are stored as RGB, so tiles can be handed to PIL without another conversion.
+        """
+        size = self.TILE_SIZE
+        height, width = img.shape[:2]
+        with self.lock:
+            if not self.levels or self.levels[0].shape != (height, width, 3):
+                self._allocate(height, width)
+            
+            # Find and copy the base tiles whose 8-bit pixels actually changed
+            base = self.levels[0]
+            dirty = set()
+            for y in range(0, height, size):
+                for x in range(0, width, size):
+                    source = img[y:y + size, x:x + size, ::-1]  # BGR to RGB as a view
+                    if source.dtype != np.uint8:
+                        source = source.astype(np.uint8)
+                    target = base[y:y + size, x:x + size]
+                    if not np.array_equal(source, target):
+                        target[...] = source
+                        dirty.add((x // size, y // size))
+            changed = len(dirty)
+            
+            # Rebuild only the parents of changed tiles on the way up
+            for level in range(len(self.levels)):
+                for key in dirty:
+                    self.versions[(level,) + key] = self.versions.get((level,) + key, 0) + 1
+                if level + 1 == len(self.levels):
+                    break
+                child, parent = self.levels[level], self.levels[level + 1]
+                dirty = {(tx // 2, ty // 2) for tx, ty in dirty}
+                for tx, ty in dirty:
+                    x0, y0 = tx * size, ty * size
+                    tile_width = min(size, parent.shape[1] - x0)
+                    tile_height = min(size, parent.shape[0] - y0)
+                    block = child[2 * y0:2 * (y0 + tile_height), 2 * x0:2 * (x0 + tile_width)]
+                    parent[y0:y0 + tile_height, x0:x0 + tile_width] = cv2.resize(
+                        block, (tile_width, tile_height), interpolation=cv2.INTER_AREA)
+            return changed
+    
+    def level_for_scale(self, scale):
+        """Pick the coarsest level that still has at least one pixel per screen pixel"""
+        level = 0
+        while level + 1 < len(self.levels) and 2 ** (level + 1) * scale <= 1.0:
+            level += 1
+        return level
+    
+    def tile(self, level, tx, ty):
+        """Return a copy of one RGB tile and its version"""
+        size = self.TILE_SIZE
+        with self.lock:
+            data = self.levels[level][ty * size:(ty + 1) * size, tx * size:(tx + 1) * size].copy()
+            return data, self.versions.get((level, tx, ty), 0)
+    
+    def tile_grid(self, level):
+        """Return the number of tile columns and rows at a level"""
+        height, width = self.levels[level].shape[:2]
+        return -(-width // self.TILE_SIZE), -(-height // self.TILE_SIZE)
+
+
+class StackCancelled(Exception):
+    """Raised inside a pipeline stage when the user cancels the run"""
+
+
+class RunControl:
+    """Cooperative pause and cancel signals checked by every pipeline stage"""
+    
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+    
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+    
+    @property
+    def paused(self):
+        return not self._running.is_set()
+    
+    def pause(self):
+        self._running.clear()
+    
+    def resume(self):
+        self._running.set()
+    
+    def cancel(self):
+        self._cancelled.set()
+        self._running.set()  # Wake paused workers so they can exit
+    
+    def checkpoint(self):
+        """Block while paused (using no CPU) and raise StackCancelled once cancelled"""
+        self._running.wait()
+        if self._cancelled.is_set():
+            raise StackCancelled()
+
+
+class FrameAligner:
+    """Estimates tripod drift of each frame against the first one
+
+    Matching runs on reduced-resolution grayscale copies of the foreground
+    only, since the stars themselves move. Transforms are cached per session
+    so re-runs skip estimation entirely.
+    """
+    
+    ANALYSIS_SIZE = 1024
+    MAX_SHIFT = 0.05  # Reject transforms that move the frame by more than 5% of its width
+    
+    def __init__(self, foreground_fraction=0.35, workers=None):
+        self.foreground_fraction = min(max(foreground_fraction, 0.05), 1.0)
+        self.workers = workers or os.cpu_count() or 4
+    
+    def cache_path(self, reference_path):
+        stat = os.stat(reference_path)
+        key = f"{os.path.abspath(reference_path)}|{stat.st_mtime_ns}|{self.foreground_fraction:.3f}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(CACHE_DIR, "alignment", f"transforms_{digest}.json")
+    
+    @staticmethod
+    def file_key(img_path):
+        return f"{os.path.basename(img_path)}|{os.stat(img_path).st_mtime_ns}"
+    
+    def load_analysis_frame(self, img_path):
+        return load_thumbnail(img_path, self.ANALYSIS_SIZE).astype(np.float32)
+    
+    def estimate(self, image_files, progress_callback=None, control=None):
+        """Return {path: 2x3 full-resolution warp}, reusing cached transforms where possible"""
+        reference_path = image_files[0]
+        cache_path = self.cache_path(reference_path)
+        cached = {}
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, "r") as f:
+                    cached = json.load(f)
+            except (OSError, ValueError):
+                cached = {}
+        
+        transforms = {}
+        missing = []
+        for img_path in image_files[1:]:
+            key = self.file_key(img_path)
+            if key in cached:
+                transforms[img_path] = np.array(cached[key], dtype=np.float32)
+            else:
+                missing.append(img_path)
+        
+        if missing:
+            reference = self.load_analysis_frame(reference_path)
+            full_width = read_frame_size(reference_path)[0]
+            scale = reference.shape[1] / full_width
+            mask = np.zeros(reference.shape[:2], dtype=np.uint8)
+            mask[int(reference.shape[0] * (1 - self.foreground_fraction)):, :] = 255
+            
+            def estimate_one(img_path):
+                if control is not None:
+                    control.checkpoint()
+                warp = self.match(reference, self.load_analysis_frame(img_path), mask)
+                # Rotation is scale-free; only the translation scales up to full resolution
+                warp[:, 2] /= scale
+                if np.hypot(warp[0, 2], warp[1, 2]) > self.MAX_SHIFT * full_width:
+                    return np.eye(2, 3, dtype=np.float32)
+                return warp
+            
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = {executor.submit(estimate_one, path): path for path in missing}
+                for done, future in enumerate(as_completed(futures), 1):
+                    img_path = futures[future]
+                    try:
+                        transforms[img_path] = future.result()
+                    except StackCancelled:
+                        raise
+                    except Exception as e:
+                        print(f"Alignment failed for {os.path.basename(img_path)}: {str(e)}")
+                        transforms[img_path] = np.eye(2, 3, dtype=np.float32)
+                    cached[self.file_key(img_path)] = transforms[img_path].tolist()
+                    if progress_callback:
+                        progress_callback(done, len(missing))
+            
+            try:
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                with open(cache_path, "w") as f:
+                    json.dump(cached, f)
+            except OSError:
+                traceback.print_exc()
+        
+        return transforms
+    
+    @staticmethod
+    def match(reference, frame, mask):
+        """Estimate the Euclidean warp from reference to frame coordinates on the masked region"""
+        warp = np.eye(2, 3, dtype=np.float32)
+        criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 100, 1e-5)
+        try:
+            _, warp = cv2.findTransformECC(reference, frame, warp, cv2.MOTION_EUCLIDEAN, criteria, mask, 5)
+        except cv2.error:
+            # ECC did not converge, fall back to a translation from phase correlation
+            rows = slice(int(np.argmax(mask[:, 0] > 0)), None)
+            window = cv2.createHanningWindow(reference[rows].shape[::-1], cv2.CV_32F)
+            (dx, dy), _ = cv2.phaseCorrelate(reference[rows], frame[rows], window)
+            warp[0, 2], warp[1, 2] = dx, dy
+        return warp
+    
+    @staticmethod
+    def apply(img, warp, out=None):
+        """Warp a decoded frame onto the reference frame's pixel grid, into `out` if given"""
+        if np.allclose(warp, np.eye(2, 3), atol=1e-3):
+            return img
+        return cv2.warpAffine(img, warp, (img.shape[1], img.shape[0]), dst=out,
+                              flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                              borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+
+# Default options for a stacking job, mirroring the controls in the UI
+DEFAULT_JOB_OPTIONS = {
+    "image_filename": "star_trail",
+    "output_format": "JPEG",
+    "trail_style": "Maximum",
+    "comet_length": 30,
+    "gap_size": 0,
+    "use_camera_wb": False,
+    "no_auto_bright": True,
+    "use_darks": False,
+    "dark_folder": "",
+    "generate_gif": False,
+    "gif_filename": "star_trail_timelapse.gif",
+    "gif_duration": 50,
+    "excluded": [],
+    "memory_budget_gb": 0,  # 0 = detect from available memory
+    "extra_tiff": False,
+    "web_jpeg": False,
+    "thumbnail": False,
+    "align_frames": False,
+    "foreground_fraction": 0.35,  # Bottom share of the frame used to measure drift
+    "video_stride": 1,  # Stack every Nth video frame
+    "video_start": 0.0,  # Seconds into the video
+    "video_end": 0.0,  # 0 = until the end
+    "top_k": 0,  # Values kept per pixel for instant exclusion, 0 = off
+    "range_blocks": 0,  # Blocks of partial stacks for the trail range slider, 0 = off
+}
+
+# Define a reasonable max size for GIF frames to reduce memory usage
+MAX_GIF_DIMENSION = 1920  # Maximum width or height
+
+# Long edge of the extra web-sized and thumbnail exports
+WEB_JPEG_DIMENSION = 2048
+THUMBNAIL_DIMENSION = 400
+
+
+def detect_memory():
+    """Return (total, available) physical memory in bytes; either may be None if unknown"""
+    try:
+        if platform.system() == "Windows":
+            import ctypes
+            
+            class MemoryStatus(ctypes.Structure):
+                _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                            ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                            ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                            ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                            ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+            
+            status = MemoryStatus()
+            status.dwLength = ctypes.sizeof(MemoryStatus)
+            ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status))
+            return int(status.ullTotalPhys), int(status.ullAvailPhys)
+        
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None, None
+    
+    # Linux reports reclaimable cache in MemAvailable; other systems fall back to half of RAM
+    available = None
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        pass
+    return total, available if available is not None else total // 2
+
+
+class MemoryGovernor:
+    """Fits decode concurrency, prefetch depth, GIF buffering and accumulator storage to a memory budget
+
+    All estimates come from frame dimensions in the file headers, so the plan
+    is ready before the first full-resolution decode.
+    """
+    
+    MIN_GIF_DIMENSION = 320
+    
+    def __init__(self, budget=None):
+        if not budget:
+            _, available = detect_memory()
+            budget = int(available * 0.8) if available else 2 * 1024 ** 3
+        self.budget = int(budget)
+    
+    def plan(self, width, height, frame_count, generate_gif=False, gap_fill=False, max_workers=None,
+             align=False, calibrate=False, top_k=0, range_blocks=0, bits=8):
+        """Return a dict describing how a run of the given size should use memory"""
+        pixels = width * height
+        frame_bytes = pixels * 3 * 4  # float32 BGR accumulator
+        # Frames stay in the decoder's 8-bit BGR until dark subtraction widens them to float32;
+        # 16-bit sources are decoded as uint16 and widened to float32 straight away
+        decoded_bytes = pixels * 3 * (2 if bits > 8 else 1)
+        widened = calibrate or bits > 8
+        stacked_bytes = frame_bytes if widened else decoded_bytes
+        decode_bytes = stacked_bytes + (decoded_bytes if widened else 0)
+        if align:
+            decode_bytes += stacked_bytes  # Warped copy of the frame
+        accumulator_bytes = frame_bytes + (frame_bytes if gap_fill else 0)  # Closing works on a temporary copy
+        accumulator_bytes += pixels * 3 * top_k * 3  # uint8 value and uint16 frame index per slot
+        if range_blocks and frame_count:
+            leaves = 1 << max(0, min(range_blocks, frame_count) - 1).bit_length()
+            accumulator_bytes += pixels * 3 * (2 * leaves - 1)  # uint8 segment tree nodes
+        
+        # Keep the accumulator in RAM unless it would leave too little room to
+        # decode at least one frame while stacking another
+        memmap_accumulator = accumulator_bytes + 2 * decode_bytes > self.budget
+        resident = 0 if memmap_accumulator else accumulator_bytes
+        
+        # GIF frames are kept as RGB when they fit in a quarter of the budget,
+        # otherwise as 8-bit palette frames, shrinking them further if needed
+        gif_mode = "rgb"
+        gif_dimension = MAX_GIF_DIMENSION
+        gif_bytes = 0
+        gif_budget = self.budget // 4
+        if generate_gif:
+            scale = min(1.0, gif_dimension / max(width, height))
+            gif_bytes = int(pixels * scale * scale) * 3 * frame_count
+            if gif_bytes > gif_budget:
+                gif_mode = "palette"
+                gif_bytes //= 3
+                while gif_bytes > gif_budget and gif_dimension // 2 >= self.MIN_GIF_DIMENSION:
+                    gif_dimension //= 2
+                    scale = min(1.0, gif_dimension / max(width, height))
+                    gif_bytes = int(pixels * scale * scale) * frame_count
+        
+        # Frames a GIF of unknown length (a streamed video) may keep before it has to thin them out
+        scale = min(1.0, gif_dimension / max(width, height))
+        gif_frame_bytes = max(1, int(pixels * scale * scale) * (3 if gif_mode == "rgb" else 1))
+        gif_max_frames = int(max(2, gif_budget // gif_frame_bytes))
+        
+        # Decode workers and read-ahead share whatever is left
+        free = self.budget - resident - gif_bytes
+        in_flight = max(1, free // decode_bytes - 1)  # One frame is always being stacked
+        workers = int(max(1, min(max_workers or os.cpu_count() or 2, in_flight)))
+        prefetch = int(max(0, min(workers, in_flight - workers)))
+        
+        return {
+            "budget": self.budget,
+            "workers": workers,
+            "prefetch": prefetch,
+            "memmap_accumulator": memmap_accumulator,
+            "gif_mode": gif_mode,
+            "gif_dimension": gif_dimension,
+            "gif_max_frames": gif_max_frames,
+            "estimated_bytes": resident + gif_bytes + (workers + prefetch + 1) * decode_bytes,
+        }
+
+
+def write_tiff16(output_path, img):
+    """Save an 8-bit image as a 16-bit TIFF"""
+    final_img_16bit = np.left_shift(img, 8, dtype=np.uint16)  # Convert 8-bit to 16-bit in one pass
+    if not cv2.imwrite(output_path, final_img_16bit):
+        raise IOError(f"Could not write {output_path}")
+
+
+def downscale_pyramid(img, dimensions):
+    """Return {dimension: image} scaled to each long-edge size, each level built from the previous one"""
+    levels = {}
+    current = img
+    for dimension in sorted(dimensions, reverse=True):
+        scale = dimension / max(current.shape[:2])
+        if scale < 1:
+            current = cv2.resize(current, (max(1, round(current.shape[1] * scale)),
+                                           max(1, round(current.shape[0] * scale))),
+                                 interpolation=cv2.INTER_AREA)
+        levels[dimension] = current
+    return levels
+
+
+def read_frame_size(img_path):
+    """Read the (width, height) of a frame from its header without decoding pixels"""
+    if is_raw_file(img_path):
+        with rawpy.imread(img_path) as raw:
+            sizes = raw.sizes
+            # LibRaw rotates portrait frames while processing, swapping the output's sides
+            return (sizes.height, sizes.width) if sizes.flip & 4 else (sizes.width, sizes.height)
+    with Image.open(img_path) as img:
+        return img.size
+
+
+def read_frame_bits(img_path):
+    """Read the bits per sample a frame decodes to (8 or 16) from its header"""
+    if is_raw_file(img_path):
+        return 8  # LibRaw is asked for 8-bit output
+    with open(img_path, "rb") as f:
+        header = f.read(26)
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return 16 if header[24] > 8 else 8  # Bit depth field of the IHDR chunk
+    if header[:4] in (b"II*\x00", b"MM\x00*"):
+        with Image.open(img_path) as img:
+            return 16 if max(img.tag_v2.get(258, (8,)) or (8,)) > 8 else 8
+    return 8
+
+
+def is_video_file(path):
+    return path.lower().endswith(VIDEO_EXTENSIONS)
+
+
+class VideoSource:
+    """Streams the frames of a video file from a background decode thread
+
+    Video decodes sequentially, so the reader walks every frame but only
+    retrieves (fully converts) the ones the stride and time window keep, and
+    stays at most a few frames ahead of the stacker through a bounded queue.
+    Memory use is constant however long the video is; GIF frames taken from
+    it are thinned out to a fixed cap (see StackPipeline.stream_video).
+    """
+    
+    def __init__(self, path, stride=1, start=0.0, end=0.0):
+        self.path = path
+        self.stride = max(1, int(stride))
+        self.start = max(0.0, float(start))
+        self.end = float(end)  # Seconds; 0 means the end of the video
+        
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            raise IOError(f"Could not open video file: {path}")
+        try:
+            self.fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+            self.frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+            self.width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+            self.height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        finally:
+            capture.release()
+    
+    def frame_range(self):
+        """Return the first and one-past-last frame index inside the time window"""
+        first = int(round(self.start * self.fps))
+        last = self.frame_count if self.frame_count > 0 else sys.maxsize  # Some containers don't know
+        if self.end > 0:
+            last = min(last, int(round(self.end * self.fps)))
+        return first, last
+    
+    def __len__(self):
+        """Number of frames that will be yielded, or 0 if the container doesn't say"""
+        first, last = self.frame_range()
+        if last == sys.maxsize:
+            return 0
+        return max(0, -(-(last - first) // self.stride))
+    
+    def frames(self, queue_size=4):
+        """Yield (frame index, BGR uint8 frame) in order while the reader thread decodes ahead"""
+        frames = queue.Queue(maxsize=max(1, queue_size))
+        stop = threading.Event()
+        first, last = self.frame_range()
+        
+        def put(item):
+            # Give up once the consumer has stopped listening
+            while not stop.is_set():
+                try:
+                    frames.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        
+        def reader():
+            capture = cv2.VideoCapture(self.path)
+            try:
+                if first > 0:
+                    capture.set(cv2.CAP_PROP_POS_FRAMES, first)
+                index = first
+                while index < last and capture.grab():
+                    if (index - first) % self.stride == 0:
+                        ok, frame = capture.retrieve()
+                        if ok and not put((index, frame)):
+                            return
+                    index += 1
+                put(None)
+            except Exception as e:
+                put(e)
+            finally:
+                capture.release()
+        
+        thread = threading.Thread(target=reader, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = frames.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()  # Lets the reader exit if the stack was cancelled or failed
+            # Wait for it to release the capture; exiting while FFmpeg's threads run aborts the process
+            thread.join()
+
+
+class StackJob:
+    """One stacking session: its frames, stacking options and output settings"""
+    
+    def __init__(self, input_folder, output_folder, options=None, image_files=None,
+                 job_id=None, state="queued", message=""):
+        self.job_id = job_id or uuid.uuid4().hex[:12]
+        self.input_folder = input_folder
+        self.output_folder = output_folder
+        self.options = dict(DEFAULT_JOB_OPTIONS, **(options or {}))
+        self.image_files = image_files
+        self.state = state
+        self.message = message
+        self.progress = 0
+        self.memory_estimate = None
+    
+    @property
+    def is_video(self):
+        return is_video_file(self.input_folder)
+    
+    @property
+    def top_k(self):
+        """Values kept per pixel for instant exclusion; only maximum stacks support it"""
+        return self.options["top_k"] if self.options["trail_style"] != "Comet" else 0
+    
+    @property
+    def range_blocks(self):
+        """Blocks of partial stacks kept for the trail range slider; only maximum stacks support it"""
+        return self.options["range_blocks"] if self.options["trail_style"] != "Comet" else 0
+    
+    def open_video(self):
+        return VideoSource(self.input_folder, self.options["video_stride"], self.options["video_start"],
+                           self.options["video_end"])
+    
+    def resolve_files(self):
+        """Return the frames to stack, honouring any exclusions"""
+        if self.is_video:
+            return [self.input_folder]
+        if self.image_files is None:
+            files = sorted([os.path.join(self.input_folder, f) for f in os.listdir(self.input_folder)
+                            if f.lower().endswith(DECODERS.extensions())])
+        else:
+            files = self.image_files
+        excluded = set(self.options["excluded"])
+        return [f for f in files if f not in excluded]
+    
+    def estimate_memory(self, budget=None):
+        """Estimate peak memory in bytes from the frame dimensions in the file headers"""
+        if self.is_video:
+            video = self.open_video()
+            width, height, frame_count = video.width, video.height, len(video)
+            align = calibrate = False
+            bits = 8
+        else:
+            image_files = self.resolve_files()
+            if not image_files:
+                return 0
+            width, height = read_frame_size(image_files[0])
+            bits = read_frame_bits(image_files[0])
+            frame_count = len(image_files)
+            align, calibrate = self.options["align_frames"], self.options["use_darks"]
+        plan = MemoryGovernor(budget or self.options["memory_budget_gb"] * 1024 ** 3).plan(
+            width, height, frame_count, self.options["generate_gif"], self.options["gap_size"] > 0,
+            align=align, calibrate=calibrate, top_k=self.top_k, range_blocks=self.range_blocks, bits=bits)
+        return plan["estimated_bytes"]
+    
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "input_folder": self.input_folder,
+            "output_folder": self.output_folder,
+            "options": self.options,
+            "image_files": self.image_files,
+            "state": self.state,
+            "message": self.message,
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["input_folder"], data["output_folder"], data.get("options"),
+                   data.get("image_files"), data.get("job_id"), data.get("state", "queued"),
+                   data.get("message", ""))
+
+
+class StackPipeline:
+    """Decode, calibrate, stack and save one job, reporting back through callbacks"""
+    
+    def __init__(self, job, on_status=None, on_progress=None, on_preview=None, on_notify=None,
+                 memory_budget=None, max_workers=None, control=None):
+        self.job = job
+        self.options = job.options
+        self.control = control or RunControl()
+        self.memory_budget = memory_budget or self.options["memory_budget_gb"] * 1024 ** 3
+        self.max_workers = max_workers
+        self.plan = None
+        self.frame_shape = None  # 8-bit BGR shape from the first frame's header, for recycled decode buffers
+        self.calibration = None
+        self.transforms = {}
+        self.final_image = None
+        self.partial_image = None
+        self.frames_stacked = 0
+        self.total_frames = 0  # Frames expected in this run, 0 if unknown
+        self.output_path = None
+        self.output_paths = []
+        self.gif_path = None
+        self.gif_frames = None  # GIF frames collected while streaming a video
+        self.top_k = None  # TopKStack for instant exclusion, when enabled
+        self.range_tree = None  # RangeStackTree for the trail range slider, when enabled
+        self.gap_kernel = None  # Applied to every stack as it is shown or saved
+        self.frame_labels = []  # Stacked frame paths (or video labels) by frame index
+        self.on_status = on_status or (lambda message: None)
+        self.on_progress = on_progress or (lambda value: None)  # None = progress unknown
+        self.on_preview = on_preview
+        self.on_notify = on_notify or (lambda message, type_: None)
+    
+    def read_image(self, img_path, fallback=True):
+        """Read an image file through the fastest decoder backend for its format
+
+        A frame that can't be read comes back black, or raises if `fallback` is False.
+        """
+        try:
+            if is_raw_file(img_path):
+                self.on_status(f"Processing RAW file: {os.path.basename(img_path)}")
+            # Decode into a recycled frame buffer where the backend supports it. Only an 8-bit one of
+            # the session's frame size qualifies; the pool also holds float32 frames and other runs' sizes
+            buffers = DECODE_POOL.buffers
+            out = buffers.acquire(np.uint8, self.frame_shape) if self.frame_shape is not None else None
+            img = DECODERS.decode(img_path, self.options, out)
+            if out is not None and img is not out:
+                buffers.release(out)
+            
+            # Frames stay 8-bit BGR (float32 for 16-bit sources); the stacker widens them as they are folded in
+            # Apply dark frame calibration to the freshly decoded frame
+            if self.calibration is not None:
+                img = buffers.transform(img, self.calibration.apply, np.float32)
+            
+            # Undo tripod drift after calibration, since hot pixels belong to the sensor grid
+            warp = self.transforms.get(img_path)
+            if warp is not None:
+                img = buffers.transform(img, lambda frame, out: FrameAligner.apply(frame, warp, out), img.dtype)
+            return img
+        except Exception as e:
+            self.on_status(f"Error reading {os.path.basename(img_path)}: {str(e)}")
+            traceback.print_exc()
+            if not fallback:
+                raise
+            # Return a black image of default size as fallback
+            return np.zeros((1080, 1920, 3), dtype=np.uint8)
+    
+    def create_stacker(self, frame_count=0):
+        """Create a trail stacker from the job's trail style options"""
+        mode = "comet" if self.options["trail_style"] == "Comet" else "max"
+        factory = None
+        if self.plan["memmap_accumulator"]:
+            # Spill the accumulator to an anonymous temporary file the OS pages in and out
+            factory = lambda shape, dtype=np.float32: np.memmap(tempfile.TemporaryFile(), dtype=dtype,
+                                                                mode="w+", shape=shape)
+        return TrailStacker(mode=mode, tail_length=self.options["comet_length"],
+                            gap_size=self.options["gap_size"], accumulator_factory=factory,
+                            top_k=self.job.top_k, range_blocks=self.job.range_blocks, frame_count=frame_count)
+    
+    def plan_memory(self, image_files, video=None):
+        """Choose worker count, prefetch depth and buffering from the frame header dimensions"""
+        if video is not None:
+            self.plan = MemoryGovernor(self.memory_budget).plan(
+                video.width, video.height, len(video), self.options["generate_gif"],
+                self.options["gap_size"] > 0, self.max_workers, top_k=self.job.top_k,
+                range_blocks=self.job.range_blocks)
+            return self.plan
+        try:
+            width, height = read_frame_size(image_files[0])
+            bits = read_frame_bits(image_files[0])
+            if bits == 8:
+                self.frame_shape = (height, width, 3)  # 16-bit frames never decode into 8-bit buffers
+        except Exception:
+            width, height, bits = 6000, 4000, 16  # Assume a large 16-bit frame if the header is unreadable
+        self.plan = MemoryGovernor(self.memory_budget).plan(
+            width, height, len(image_files), self.options["generate_gif"], self.options["gap_size"] > 0,
+            self.max_workers, align=self.options["align_frames"], calibrate=self.options["use_darks"],
+            top_k=self.job.top_k, range_blocks=self.job.range_blocks, bits=bits)
+        return self.plan
+    
+    def read_image_checked(self, img_path):
+        """Wait out a pause and honour a cancel before starting an expensive decode"""
+        self.control.checkpoint()
+        return self.read_image(img_path)
+    
+    def decode_frames(self, image_files):
+        """Yield (path, frame) in order while worker threads decode ahead"""
+        depth = self.plan["workers"] + self.plan["prefetch"]
+        if depth <= 1:
+            for img_path in image_files:
+                yield img_path, self.read_image_checked(img_path)
+            return
+        
+        # Decode on the shared warm pool, using no more of its threads than planned
+        limiter = threading.Semaphore(self.plan["workers"])
+        pending = deque()
+        try:
+            remaining = iter(image_files)
+            pending.extend((path, DECODE_POOL.submit(limiter, self.read_image_checked, path))
+                           for path in itertools.islice(remaining, depth))
+            while pending:
+                img_path, future = pending.popleft()
+                img = future.result()
+                # Queue the next decode before handing this frame over
+                next_path = next(remaining, None)
+                if next_path is not None:
+                    pending.append((next_path, DECODE_POOL.submit(limiter, self.read_image_checked, next_path)))
+                yield img_path, img
+        finally:
+            # Drop queued decodes; on cancel, don't wait for the running ones either
+            for _, future in pending:
+                future.cancel()
+            if not self.control.cancelled:
+                wait([future for _, future in pending])
+    
+    def prepare_calibration(self, image_files):
+        """Build or load the master dark for this run, if dark subtraction is enabled"""
+        self.calibration = None
+        if not self.options["use_darks"]:
+            return
+        
+        dark_folder = self.options["dark_folder"]
+        decode_options = [self.options["use_camera_wb"], self.options["no_auto_bright"]]
+        if dark_folder:
+            def report(done, total):
+                self.control.checkpoint()
+                self.on_status(f"Averaging dark frame {done}/{total}...")
+            
+            self.on_status("Preparing master dark...")
+            read_dark = lambda path: self.read_image(path, fallback=False)
+            calibration = DarkCalibration.from_folder(dark_folder, read_dark, decode_options, report)
+        else:
+            info = read_capture_info(image_files[0])
+            if not capture_info_known(info):
+                # Without camera, ISO and exposure the cache key would match darks from any session
+                self.on_notify("Camera, ISO or exposure of these images is unknown, so no cached master dark "
+                               "can be matched. Select a dark frame folder.", "warning")
+                return
+            calibration = DarkCalibration.load_cached(info)
+            if calibration is None:
+                self.on_notify("No cached master dark matches these images. Select a dark frame folder.", "warning")
+                return
+        
+        # A master from another camera, crop or orientation would otherwise be skipped frame by frame
+        height, width = calibration.master_dark.shape[:2]
+        try:
+            frame_width, frame_height = read_frame_size(image_files[0])
+        except Exception:
+            frame_width, frame_height = width, height  # Let the decode itself report an unreadable frame
+        if (frame_width, frame_height) != (width, height):
+            message = (f"The master dark is {width}x{height} but the frames are {frame_width}x{frame_height}. "
+                       f"Select dark frames taken with the same camera and settings.")
+            if dark_folder:
+                raise ValueError(message)
+            self.on_notify(message, "warning")
+            return
+        
+        self.calibration = calibration
+        self.on_status(f"Master dark ready ({calibration.hot_pixels.size} hot pixels mapped)")
+    
+    def prepare_alignment(self, image_files):
+        """Estimate (or load cached) per-frame drift transforms, if alignment is enabled"""
+        self.transforms = {}
+        if not self.options["align_frames"] or len(image_files) < 2:
+            return
+        
+        self.on_status("Measuring tripod drift...")
+        aligner = FrameAligner(self.options["foreground_fraction"], workers=self.max_workers)
+        self.transforms = aligner.estimate(
+            image_files, lambda done, total: self.on_status(f"Measuring drift {done}/{total}..."), self.control)
+        
+        shifts = [np.hypot(w[0, 2], w[1, 2]) for w in self.transforms.values()]
+        if shifts:
+            self.on_status(f"Frames aligned (largest drift {max(shifts):.1f} px)")
+    
+    def stream_video(self, video):
+        """Yield (label, frame) from a video, handing small copies to the GIF writer on the way
+
+        The GIF keeps at most the planned number of frames: whenever that fills
+        up, every other kept frame is dropped and half as many are kept from then on.
+        """
+        name = os.path.basename(video.path)
+        queue_size = self.plan["workers"] + self.plan["prefetch"]
+        gif_step = 1
+        for streamed, (index, frame) in enumerate(video.frames(queue_size)):
+            if self.gif_frames is not None and streamed % gif_step == 0:
+                # Shrink with OpenCV first so only a GIF-sized copy is converted and kept
+                scale = self.plan["gif_dimension"] / max(frame.shape[:2])
+                small = frame
+                if scale < 1:
+                    small = cv2.resize(frame, (int(frame.shape[1] * scale), int(frame.shape[0] * scale)),
+                                       interpolation=cv2.INTER_AREA)
+                self.gif_frames.append(self.gif_frame(Image.fromarray(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))))
+                if len(self.gif_frames) >= self.plan["gif_max_frames"]:
+                    # Kept frames sit at multiples of the step, so the survivors sit at multiples of twice it
+                    for img in self.gif_frames[1::2]:
+                        img.close()
+                    del self.gif_frames[1::2]
+                    gif_step *= 2
+            yield f"{name} frame {index}", frame
+    
+    def stack(self, frames, total_images):
+        """Stack (label, frame) pairs in place and return the float32 accumulator, its gaps filled
+
+        On cancel the frames stacked so far are kept in partial_image.
+        """
+        stacker = self.create_stacker(total_images)
+        self.gap_kernel = stacker.gap_kernel
+        if self.job.range_blocks and not total_images:
+            self.on_notify("This video doesn't report its length, so the trail range slider is unavailable", "warning")
+        if self.job.top_k and not stacker.top_k_depth:
+            self.on_notify(f"Instant frame exclusion needs a known length of at most {TopKStack.MAX_FRAMES} frames, "
+                           f"so it is off for this run", "warning")
+        base_img = None
+        self.total_frames = total_images  # Some videos don't report their length
+        
+        try:
+            for i, (img_path, img) in enumerate(frames):
+                self.control.checkpoint()
+                try:
+                    base_img = stacker.add(img)  # Keep the brightest (or fading) pixels
+                    self.frames_stacked = stacker.count
+                    self.frame_labels.append(img_path)
+                    DECODE_POOL.buffers.release(img)  # Folded in, so the next decode can reuse it
+                    del img
+                    
+                    # Update progress bar
+                    if not total_images:
+                        self.on_progress(None)
+                        self.on_status(f"Processing frame {i + 1}")
+                    else:
+                        progress_value = max(1, int((i / total_images) * 100))
+                        self.on_progress(progress_value)
+                        if i > 0:
+                            self.on_status(f"Processing image {i}/{total_images} ({progress_value}%)")
+                    
+                    # Update preview with the first image, then periodically (every 5 images or final image).
+                    # The callback runs between frames, so it may read the accumulator without a copy
+                    if self.on_preview and (i % 5 == 0 or i == total_images - 1):
+                        self.on_preview(TrailStacker.close_gaps(base_img, self.gap_kernel))
+                except Exception as e:
+                    # Log the error but continue processing other images
+                    error_msg = f"Error processing {os.path.basename(img_path)}: {str(e)}"
+                    print(error_msg)
+                    self.on_status(error_msg)
+                    traceback.print_exc()
+        except StackCancelled:
+            if base_img is not None:
+                self.partial_image = np.uint8(np.asarray(TrailStacker.close_gaps(base_img, self.gap_kernel)))
+            raise
+        
+        if base_img is None:
+            raise ValueError("None of the selected images could be stacked")
+        if stacker.top_k_depth and stacker.top_k is None:
+            self.on_notify(f"More than {TopKStack.MAX_FRAMES} frames were stacked, so instant frame exclusion "
+                           f"is unavailable", "warning")
+        self.top_k = stacker.top_k
+        self.range_tree = stacker.range_tree
+        return TrailStacker.close_gaps(base_img, self.gap_kernel)
+    
+    def restack(self, excluded):
+        """Rebuild final_image without the given frames from the top-K stack, decoding nothing
+
+        Returns the number of pixels that could not be resolved exactly.
+        """
+        index_of = {label: i for i, label in enumerate(self.frame_labels)}
+        indices = [index_of[label] for label in excluded if label in index_of]
+        self.final_image, unresolved = self.top_k.without(indices)
+        TrailStacker.close_gaps(self.final_image, self.gap_kernel)
+        return unresolved
+    
+    def stack_range(self, first, last):
+        """Set final_image to the stack of frames first..last from the partial stacks, decoding nothing
+
+        The range is widened to whole blocks; returns the (first, last) frames actually used.
+        """
+        self.final_image, frame_range = self.range_tree.stack(first, last)
+        TrailStacker.close_gaps(self.final_image, self.gap_kernel)
+        return frame_range
+    
+    def export_range(self, first, last):
+        """Write the still outputs for a frame range next to the full stack, named after the range"""
+        options = self.options
+        base_name, extension = os.path.splitext(options["image_filename"])
+        self.options = dict(options, image_filename=f"{base_name}_frames_{first + 1}-{last + 1}{extension}")
+        try:
+            self.export([], include_gif=False)
+        finally:
+            self.options = options
+        return self.output_paths
+    
+    def save_image(self):
+        """Write the final image in the job's output format and return its path"""
+        output_path = os.path.join(self.job.output_folder, self.options["image_filename"])
+        
+        # Ensure the correct extension is added
+        chosen_format = self.options["output_format"]
+        if chosen_format == "JPEG":
+            if not output_path.lower().endswith(('.jpg', '.jpeg')):
+                output_path += '.jpg'
+            # Save as JPEG with 100% quality
+            cv2.imwrite(output_path, self.final_image, [cv2.IMWRITE_JPEG_QUALITY, 100])
+        elif chosen_format == "TIFF":
+            if not output_path.lower().endswith(('.tif', '.tiff')):
+                output_path += '.tiff'
+            # Save as TIFF (16-bit for better quality)
+            write_tiff16(output_path, self.final_image)
+        elif chosen_format == "DNG":
+            if not output_path.lower().endswith('.dng'):
+                output_path += '.dng'
+            # For DNG format, we need specialized handling
+            try:
+                # Hand the writer an RGB view rather than a converted copy
+                imageio.imwrite(output_path, self.final_image[:, :, ::-1])
+            except Exception as e:
+                # Fallback to TIFF if DNG handling fails
+                output_path = output_path.replace('.dng', '.tiff')
+                write_tiff16(output_path, self.final_image)
+                self.on_notify(f"DNG format failed, saved as TIFF instead. Error: {str(e)}", "warning")
+        
+        return output_path
+    
+    def extra_output_path(self, suffix):
+        """Path for an extra export next to the main image, e.g. star_trail_web.jpg"""
+        base_name = os.path.splitext(self.options["image_filename"])[0]
+        return os.path.join(self.job.output_folder, base_name + suffix)
+    
+    def save_extra_tiff(self):
+        output_path = self.extra_output_path("_full.tiff")
+        write_tiff16(output_path, self.final_image)
+        return [output_path]
+    
+    def save_downscaled(self):
+        """Write the web-sized JPEG and thumbnail from one shared downscale pyramid"""
+        wanted = {}
+        if self.options["web_jpeg"]:
+            wanted[WEB_JPEG_DIMENSION] = (self.extra_output_path("_web.jpg"), 90)
+        if self.options["thumbnail"]:
+            wanted[THUMBNAIL_DIMENSION] = (self.extra_output_path("_thumb.jpg"), 85)
+        
+        written = []
+        for dimension, img in downscale_pyramid(self.final_image, wanted).items():
+            output_path, quality = wanted[dimension]
+            if not cv2.imwrite(output_path, img, [cv2.IMWRITE_JPEG_QUALITY, quality]):
+                raise IOError(f"Could not write {output_path}")
+            written.append(output_path)
+        return written
+    
+    def export(self, image_files, include_gif=True):
+        """Write every requested output in parallel, encoding the GIF alongside the still images
+
+        Total export time is that of the slowest writer rather than the sum.
+        """
+        executor = ThreadPoolExecutor(max_workers=4)
+        try:
+            gif_future = None
+            if include_gif and self.gif_frames is not None:
+                gif_future = executor.submit(self.save_gif, self.gif_frames)
+            elif include_gif and self.options["generate_gif"]:
+                gif_future = executor.submit(self.create_gif, image_files)
+            image_future = executor.submit(self.save_image)
+            
+            extra_futures = []
+            if self.options["extra_tiff"] and self.options["output_format"] != "TIFF":
+                extra_futures.append(executor.submit(self.save_extra_tiff))
+            if self.options["web_jpeg"] or self.options["thumbnail"]:
+                extra_futures.append(executor.submit(self.save_downscaled))
+            
+            self.output_path = image_future.result()
+            self.output_paths = [self.output_path]
+            for future in extra_futures:
+                try:
+                    self.output_paths.extend(future.result())
+                except Exception as e:
+                    traceback.print_exc()
+                    self.on_notify(f"Could not write an extra output: {str(e)}", "warning")
+            
+            if gif_future is not None:
+                self.gif_path = gif_future.result()
+        finally:
+            # A cancelled GIF must not hold up the still images that were already written
+            executor.shutdown(wait=not self.control.cancelled, cancel_futures=True)
+    
+    def gif_frame(self, img):
+        """Shrink and convert one PIL frame to what the memory plan allows the GIF to keep"""
+        # Resize if image is too large for the memory plan
+        max_dimension = self.plan["gif_dimension"]
+        if max(img.size) > max_dimension:
+            ratio = max_dimension / max(img.size)
+            new_size = tuple(int(dim * ratio) for dim in img.size)
+            img = img.resize(new_size, Image.Resampling.LANCZOS)
+        
+        # Convert to RGB if needed (for consistency)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        
+        # Palette frames take a third of the memory of RGB ones
+        if self.plan["gif_mode"] == "palette":
+            img = img.quantize(colors=256)
+        return img
+    
+    def create_gif(self, image_files):
+        """Write the timelapse GIF and return its path, or None if no frame could be read"""
+        self.on_status("Creating GIF...")
+        
+        # Process images one at a time to reduce memory usage
+        pil_images = []
+        total_gif_images = len(image_files)
+        
+        for idx, img_path in enumerate(image_files):
+            self.control.checkpoint()
+            try:
+                # Update status
+                self.on_status(f"Processing GIF frame {idx+1}/{total_gif_images}...")
+                
+                # Open and resize image
+                pil_images.append(self.gif_frame(Image.open(img_path)))
+            
+            except Exception as e:
+                self.on_status(f"Warning: Could not open {os.path.basename(img_path)}: {str(e)}")
+                continue
+        
+        return self.save_gif(pil_images)
+    
+    def save_gif(self, pil_images):
+        """Write prepared GIF frames and return the GIF's path, or None if there are none"""
+        gif_path = os.path.join(self.job.output_folder, self.options["gif_filename"])
+        if not pil_images:
+            self.on_status("Error: No valid images found for GIF creation")
+            self.on_notify("Could not create GIF: No valid images found", "error")
+            return None
+        
+        self.on_status("Saving GIF...")
+        pil_images[0].save(
+            gif_path,
+            save_all=True,
+            append_images=pil_images[1:],
+            duration=self.options["gif_duration"],
+            loop=0,
+            optimize=False  # Disable optimization to speed up saving
+        )
+        
+        # Clean up memory
+        for img in pil_images:
+            img.close()
+        pil_images.clear()
+        return gif_path
+    
+    def run(self):
+        """Run the whole job and return the final 8-bit image"""
+        self.on_status("Reading images...")
+        
+        video = None
+        if self.job.is_video:
+            video = self.job.open_video()
+            image_files = []
+        else:
+            image_files = self.job.resolve_files()
+            if not image_files:
+                raise ValueError("No image files found in the selected folder")
+        
+        plan = self.plan_memory(image_files, video)
+        self.on_status(f"Memory plan: {plan['workers']} decode workers, prefetch {plan['prefetch']}, "
+                       f"{'memory-mapped' if plan['memmap_accumulator'] else 'in-memory'} accumulator, "
+                       f"{plan['gif_mode']} GIF frames, ~{plan['estimated_bytes'] / 1024 ** 3:.1f} of "
+                       f"{plan['budget'] / 1024 ** 3:.1f} GB")
+        
+        if video is not None:
+            if self.options["use_darks"] or self.options["align_frames"]:
+                self.on_notify("Dark frames and alignment apply to image folders only, skipped for video", "warning")
+            self.gif_frames = [] if self.options["generate_gif"] else None
+            base_img = self.stack(self.stream_video(video), len(video))
+        else:
+            self.prepare_calibration(image_files)
+            self.prepare_alignment(image_files)
+            base_img = self.stack(self.decode_frames(image_files), len(image_files))
+        
+        # Convert back to 8-bit image format
+        self.final_image = np.uint8(np.asarray(base_img))
+        del base_img  # Release a memory-mapped accumulator
+        if self.on_preview:
+            self.on_preview(self.final_image)
+        
+        self.export(image_files)
+        return self.final_image
+
+
+class JobQueue:
+    """Persistent queue of stacking sessions run concurrently within a CPU and memory budget"""
+    
+    STATE_FILE = os.path.join(CACHE_DIR, "job_queue.json")
+    
+    def __init__(self, max_concurrent=None, memory_budget=None, on_change=None):
+        self.max_concurrent = max_concurrent or max(1, (os.cpu_count() or 2) // 2)
+        total_memory, _ = detect_memory()
+        self.memory_budget = memory_budget or (int(total_memory * 0.6) if total_memory else 4 * 1024 ** 3)
+        self.on_change = on_change
+        self.jobs = []
+        self._running = {}  # job_id -> reserved bytes
+        self._controls = {}  # job_id -> RunControl of a running job
+        self._condition = threading.Condition()
+        self._save_lock = threading.Lock()  # Orders saves from the scheduler and job threads
+        self._active = False
+        self._scheduler = None
+        self._shutting_down = False
+        self.load()
+    
+    @property
+    def active(self):
+        return self._active
+    
+    def load(self):
+        """Restore the queue saved by a previous session"""
+        if not os.path.exists(self.STATE_FILE):
+            return
+        try:
+            with open(self.STATE_FILE, "r") as f:
+                data = json.load(f)
+            for entry in data.get("jobs", []):
+                job = StackJob.from_dict(entry)
+                # Jobs interrupted by a restart go back to the queue
+                if job.state == "running":
+                    job.state = "queued"
+                    job.message = "Interrupted, queued again"
+                self.jobs.append(job)
+        except Exception:
+            traceback.print_exc()
+    
+    def save(self):
+        """Persist the queue so it survives application restarts"""
+        # Snapshot and write under one lock so an older snapshot never replaces a newer one;
+        # the queue itself stays unlocked during the write
+        with self._save_lock:
+            with self._condition:
+                data = {"jobs": [job.to_dict() for job in self.jobs]}
+            try:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                tmp_path = f"{self.STATE_FILE}.{uuid.uuid4().hex[:8]}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(data, f, indent=2)
+                os.replace(tmp_path, self.STATE_FILE)
+            except OSError:
+                traceback.print_exc()
+    
+    def add(self, job):
+        with self._condition:
+            self.jobs.append(job)
+            self._condition.notify_all()
+        self._changed()
+    
+    def remove(self, job_id):
+        """Remove a job that is not currently running"""
+        with self._condition:
+            self.jobs = [job for job in self.jobs if job.job_id != job_id or job.state == "running"]
+        self._changed()
+    
+    def clear_finished(self):
+        with self._condition:
+            self.jobs = [job for job in self.jobs if job.state not in ("done", "failed", "cancelled")]
+        self._changed()
+    
+    def cancel(self, job_id):
+        """Cancel a running job after its current frame, or drop a queued one from the schedule"""
+        with self._condition:
+            control = self._controls.get(job_id)
+            for job in self.jobs:
+                if job.job_id == job_id and job.state == "queued":
+                    job.state = "cancelled"
+                    job.message = "Cancelled"
+        if control is not None:
+            control.cancel()
+        self._changed()
+    
+    def start(self):
+        """Start scheduling queued jobs in the background"""
+        with self._condition:
+            self._active = True
+            self._condition.notify_all()
+            if self._scheduler is None or not self._scheduler.is_alive():
+                self._scheduler = threading.Thread(target=self._schedule, daemon=True)
+                self._scheduler.start()
+        self._notify()
+    
+    def stop(self):
+        """Stop launching new jobs; running jobs finish normally"""
+        with self._condition:
+            self._active = False
+            self._condition.notify_all()
+        self._notify()
+    
+    def shutdown(self):
+        """Stop scheduling and cancel running jobs, so no decode thread stays blocked in a pause at exit
+
+        The interrupted jobs are queued again for the next session.
+        """
+        with self._condition:
+            self._shutting_down = True
+            self._active = False
+            controls = list(self._controls.values())
+            self._condition.notify_all()
+        for control in controls:
+            control.cancel()
+    
+    def job_budget(self, job):
+        """Memory a single job may plan for: its own setting, or a fair share of the queue budget"""
+        if job.options["memory_budget_gb"]:
+            return int(job.options["memory_budget_gb"] * 1024 ** 3)
+        return self.memory_budget // self.max_concurrent
+    
+    def _schedule(self):
+        while True:
+            with self._condition:
+                if not self._active:
+                    break
+                unestimated = [job for job in self.jobs if job.state == "queued" and job.memory_estimate is None]
+            
+            # Header reads and video probes stay outside the lock, so the UI can add or cancel meanwhile
+            changed = False
+            for job in unestimated:
+                try:
+                    job.memory_estimate = job.estimate_memory(self.job_budget(job))
+                except Exception as e:
+                    with self._condition:
+                        if job.state == "queued":
+                            job.state = "failed"
+                            job.message = f"Could not read frames: {str(e)}"
+                    changed = True
+            
+            starting = []
+            with self._condition:
+                for job in self.jobs:
+                    if job.state != "queued" or job.memory_estimate is None:
+                        continue
+                    if len(self._running) >= self.max_concurrent:
+                        break
+                    
+                    # A job that alone exceeds the budget still runs, just never alongside others
+                    reserved = sum(self._running.values())
+                    if self._running and reserved + job.memory_estimate > self.memory_budget:
+                        continue
+                    
+                    job.state = "running"
+                    job.message = "Starting..."
+                    self._running[job.job_id] = job.memory_estimate
+                    starting.append(job)
+                
+                finished = not self._running and not any(job.state == "queued" for job in self.jobs)
+                if finished:
+                    self._active = False
+                elif not (changed or starting):
+                    self._condition.wait(timeout=1.0)
+            
+            for job in starting:
+                threading.Thread(target=self._run_job, args=(job,), daemon=True).start()
+            if changed or starting:
+                self._changed()  # Saves the queue, outside the lock
+            if finished:
+                break
+        self._notify()
+    
+    def _run_job(self, job):
+        def report_progress(value):
+            if value is not None:
+                job.progress = value
+                self._notify()
+        
+        def report_status(message):
+            job.message = message
+        
+        control = RunControl()
+        with self._condition:
+            self._controls[job.job_id] = control
+        try:
+            StackPipeline(job, on_status=report_status, on_progress=report_progress,
+                          memory_budget=self.job_budget(job),
+                          max_workers=max(1, (os.cpu_count() or 2) // self.max_concurrent),
+                          control=control).run()
+            job.state = "done"
+            job.progress = 100
+            job.message = f"Saved to {job.output_folder}"
+        except StackCancelled:
+            if self._shutting_down:
+                job.state = "queued"
+                job.message = "Interrupted, queued again"
+            else:
+                job.state = "cancelled"
+                job.message = "Cancelled"
+        except Exception as e:
+            traceback.print_exc()
+            job.state = "failed"
+            job.message = str(e)
+        finally:
+            with self._condition:
+                self._running.pop(job.job_id, None)
+                self._controls.pop(job.job_id, None)
+                self._condition.notify_all()
+            self._changed()
+    
+    def _changed(self):
+        self.save()
+        self._notify()
+    
+    def _notify(self):
+        if self.on_change:
+            self.on_change()
+
+
 class StarTrailGenerator:
     def __init__(self, root):
         self.root = root
@@ -190,9 +2472,34 @@ class StarTrailGenerator:
         
         self.image_folder = ""
         self.image_files = []
+        self.excluded_files = set()
+        self.run_control = None
+        
+        # Thumbnail strip state
+        self.strip_images = {}  # frame index -> PhotoImage
+        self._strip_generation = 0
         self.output_folder = ""
         self.final_image = None
-        self.preview_image = None
+        
+        # Last maximum stack with top-K values, for instant exclusion
+        self.restack_pipeline = None
+        self.stacked_excluded = set()  # Frames that were already left out of that stack
+        self._restack_generation = 0
+        self._restack_lock = threading.Lock()
+        
+        # Last maximum stack with partial stacks, for the trail range slider
+        self.range_pipeline = None
+        self._range_generation = 0
+        self._range_resetting = False  # Set while the sliders are moved programmatically
+        
+        # Zoomable preview state
+        self.preview_pyramid = PreviewPyramid()
+        self.preview_tiles = {}  # (level, tx, ty) -> ((version, tile size), PhotoImage)
+        self.preview_fit = True
+        self.preview_scale = 1.0
+        self.preview_center = (0.0, 0.0)
+        self.preview_drag = None
+        self._preview_render_pending = False
         
         # Initialize variables
         self.use_camera_wb = tk.BooleanVar(value=False)
@@ -202,7 +2509,26 @@ class StarTrailGenerator:
         self.status_var = tk.StringVar(value="Ready")
         self.generate_gif = tk.BooleanVar(value=False)
         self.output_format = tk.StringVar(value="JPEG")
-        
+        self.trail_style = tk.StringVar(value="Maximum")
+        self.fill_gaps = tk.BooleanVar(value=False)
+        self.use_darks = tk.BooleanVar(value=False)
+        self.memory_budget_gb = tk.DoubleVar(value=0)
+        self.extra_tiff = tk.BooleanVar(value=False)
+        self.web_jpeg = tk.BooleanVar(value=False)
+        self.thumbnail = tk.BooleanVar(value=False)
+        self.align_frames = tk.BooleanVar(value=False)
+        self.instant_exclusion = tk.BooleanVar(value=False)
+        self.trail_range = tk.BooleanVar(value=False)
+        self.dark_folder = ""
+        
+        # Batch queue of stacking sessions, restored from the previous run
+        self._queue_refresh_pending = False
+        self.job_queue = JobQueue(on_change=self.schedule_queue_refresh)
+        
+        # Start the shared decode threads now, so the first run doesn't wait for them
+        DECODE_POOL.warm_up()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
         # Set icon (placeholder)
         if platform.system() == "Windows":
             try:
@@ -225,7 +2551,21 @@ class StarTrailGenerator:
         
         # Initialize control states based on the toggle
         self.update_gif_controls()
-    
+        self.update_trail_controls()
+        self.refresh_queue()
+
+    def on_close(self):
+        """Cancel any running or paused work, then close the window
+
+        Paused decodes wait on the shared pool's worker threads, which the
+        interpreter joins at exit, so leaving them paused would hang the process.
+        """
+        if self.run_control is not None:
+            self.run_control.cancel()
+        self.job_queue.on_change = None  # The window is going away; jobs still save their state
+        self.job_queue.shutdown()
+        self.root.destroy()
+
     def update_gif_controls(self, *args):
         """Enable or disable GIF-related controls based on toggle state"""
         if self.generate_gif.get():
@@ -235,6 +2575,15 @@ class StarTrailGenerator:
             self.gif_filename.config(state="disabled")
             self.gif_duration.config(state="disabled")
 
+    def update_trail_controls(self, *args):
+        """Enable or disable trail style controls based on the selected mode"""
+        self.comet_length.config(state="normal" if self.trail_style.get() == "Comet" else "disabled")
+        self.gap_size.config(state="normal" if self.fill_gaps.get() else "disabled")
+        top_k_enabled = self.instant_exclusion.get() and self.trail_style.get() != "Comet"
+        self.top_k_depth.config(state="normal" if top_k_enabled else "disabled")
+        range_enabled = self.trail_range.get() and self.trail_style.get() != "Comet"
+        self.range_blocks.config(state="readonly" if range_enabled else "disabled")
+
     def update_filename_extension(self, event=None):
         """Update the filename extension based on the selected output format"""
         # Get current filename without extension
@@ -315,7 +2664,7 @@ class StarTrailGenerator:
         file_menu.add_command(label="Select Output Folder", command=self.browse_output, 
                              accelerator="Ctrl+S", compound=tk.LEFT)
         file_menu.add_separator()
-        file_menu.add_command(label="Exit", command=self.root.destroy,
+        file_menu.add_command(label="Exit", command=self.on_close,
                              compound=tk.LEFT)
         
         # Process menu
@@ -323,6 +2672,8 @@ class StarTrailGenerator:
         menubar.add_cascade(label="Process", menu=process_menu)
         process_menu.add_command(label="Generate Star Trail", command=self.process_images, 
                                 accelerator="Ctrl+G", compound=tk.LEFT)
+        process_menu.add_command(label="Analyze Frames", command=self.analyze_frames,
+                                compound=tk.LEFT)
         
         # View menu
         view_menu = tk.Menu(menubar, tearoff=0)
@@ -359,6 +2710,10 @@ class StarTrailGenerator:
         options_tab = ttk.Frame(self.notebook, padding=10)
         self.notebook.add(options_tab, text="Advanced Options")
         
+        # Batch queue tab
+        queue_tab = ttk.Frame(self.notebook, padding=10)
+        self.notebook.add(queue_tab, text="Batch Queue")
+        
         # ---- Main Tab Content ----
         # Folders card
         folder_card = ttk.Frame(main_tab, style="Card.TFrame", padding=15)
@@ -376,12 +2731,15 @@ class StarTrailGenerator:
         browse_btn = ttk.Button(input_frame, text="Browse...", command=self.browse_folder)
         browse_btn.pack(side=tk.LEFT)
         ModernTooltip(browse_btn, "Select folder containing your star images")
+        video_btn = ttk.Button(input_frame, text="Video...", command=self.browse_video)
+        video_btn.pack(side=tk.LEFT, padx=(5, 0))
+        ModernTooltip(video_btn, "Stack the frames of a video or in-camera interval movie instead")
         
         # Format note
         format_frame = ttk.Frame(folder_card)
         format_frame.pack(fill=tk.X, pady=5)
         ttk.Label(format_frame, text="Supported formats:", font=("Default", 9)).pack(side=tk.LEFT)
-        ttk.Label(format_frame, text=" JPG, JPEG, PNG, TIF, TIFF, ARW (Sony RAW)", 
+        ttk.Label(format_frame, text=" JPG, PNG, TIFF, camera RAW (ARW, CR2, CR3, NEF, RAF, DNG, ...) or a video (MP4, MOV, AVI, MKV)", 
                  font=("Default", 9, "italic")).pack(side=tk.LEFT)
         
         # Output folder row
@@ -424,14 +2782,83 @@ class StarTrailGenerator:
 
         ModernTooltip(format_dropdown, "Select output image format (all use 100% quality)")
         
+        # Extra outputs written in parallel with the main image and GIF
+        extras_frame = ttk.Frame(output_file_card)
+        extras_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(extras_frame, text="Also Save:").pack(side=tk.LEFT)
+        CustomSwitch(extras_frame, text="16-bit TIFF", variable=self.extra_tiff).pack(side=tk.LEFT, padx=10)
+        CustomSwitch(extras_frame, text=f"Web JPEG ({WEB_JPEG_DIMENSION} px)",
+                     variable=self.web_jpeg).pack(side=tk.LEFT, padx=10)
+        CustomSwitch(extras_frame, text=f"Thumbnail ({THUMBNAIL_DIMENSION} px)",
+                     variable=self.thumbnail).pack(side=tk.LEFT, padx=10)
+        
+        # Sequence thumbnail strip card
+        strip_card = ttk.Frame(main_tab, style="Card.TFrame", padding=15)
+        strip_card.pack(fill=tk.X, pady=(0, 15))
+        
+        strip_header = ttk.Frame(strip_card)
+        strip_header.pack(fill=tk.X, pady=(0, 10))
+        
+        ttk.Label(strip_header, text="Sequence", style="Heading.TLabel").pack(side=tk.LEFT)
+        ttk.Label(strip_header, text="Double-click a frame to exclude or restore it").pack(side=tk.RIGHT)
+        
+        self.strip_canvas = tk.Canvas(strip_card, height=STRIP_HEIGHT + 8, bg="black", highlightthickness=0)
+        self.strip_canvas.pack(fill=tk.X)
+        strip_scrollbar = ttk.Scrollbar(strip_card, orient=tk.HORIZONTAL, command=self.strip_canvas.xview)
+        strip_scrollbar.pack(fill=tk.X)
+        self.strip_canvas.configure(xscrollcommand=strip_scrollbar.set)
+        self.strip_canvas.bind("<Button-1>", self.on_strip_click)
+        self.strip_canvas.bind("<Double-Button-1>", self.on_strip_double_click)
+        ModernTooltip(self.strip_canvas, "Double-click a frame to exclude it from (or restore it to) the stack")
+        
         # Preview area card
         preview_card = ttk.Frame(main_tab, style="Card.TFrame", padding=15)
         preview_card.pack(fill=tk.BOTH, expand=True, pady=(0, 15))
         
-        ttk.Label(preview_card, text="Preview", style="Heading.TLabel").pack(anchor=tk.W, pady=(0, 10))
+        preview_header = ttk.Frame(preview_card)
+        preview_header.pack(fill=tk.X, pady=(0, 10))
+        
+        ttk.Label(preview_header, text="Preview", style="Heading.TLabel").pack(side=tk.LEFT)
+        ttk.Button(preview_header, text="1:1", width=4,
+                  command=lambda: self.set_preview_zoom(1.0)).pack(side=tk.RIGHT, padx=(5, 0))
+        ttk.Button(preview_header, text="Fit", width=4,
+                  command=self.fit_preview).pack(side=tk.RIGHT, padx=(5, 0))
+        self.zoom_label = ttk.Label(preview_header, text="")
+        self.zoom_label.pack(side=tk.RIGHT, padx=10)
         
-        self.canvas = tk.Canvas(preview_card, bg="black")
+        self.canvas = tk.Canvas(preview_card, bg="black", highlightthickness=0)
         self.canvas.pack(fill=tk.BOTH, expand=True)
+        ModernTooltip(self.canvas, "Scroll to zoom, drag to pan, double-click to toggle 1:1")
+        
+        # Zoom and pan bindings (Button-4/5 are the Linux wheel events)
+        self.canvas.bind("<Configure>", lambda e: self.schedule_preview_render())
+        self.canvas.bind("<MouseWheel>", self.on_preview_wheel)
+        self.canvas.bind("<Button-4>", self.on_preview_wheel)
+        self.canvas.bind("<Button-5>", self.on_preview_wheel)
+        self.canvas.bind("<ButtonPress-1>", self.on_preview_press)
+        self.canvas.bind("<B1-Motion>", self.on_preview_drag)
+        self.canvas.bind("<Double-Button-1>", self.on_preview_double_click)
+        
+        # Trail range sliders, live once a run has kept its partial stacks
+        range_frame = ttk.Frame(preview_card)
+        range_frame.pack(fill=tk.X, pady=(10, 0))
+        
+        ttk.Label(range_frame, text="Frames:").pack(side=tk.LEFT)
+        self.range_start = ttk.Scale(range_frame, from_=0, to=1, orient=tk.HORIZONTAL,
+                                     command=lambda value: self.on_range_change("start"))
+        self.range_start.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        self.range_end = ttk.Scale(range_frame, from_=0, to=1, orient=tk.HORIZONTAL,
+                                   command=lambda value: self.on_range_change("end"))
+        self.range_end.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        self.range_label = ttk.Label(range_frame, text="", width=16)
+        self.range_label.pack(side=tk.LEFT, padx=5)
+        self.save_range_button = ttk.Button(range_frame, text="Save Range", command=self.save_trail_range)
+        self.save_range_button.pack(side=tk.RIGHT, padx=(5, 0))
+        ModernTooltip(self.range_start, "First frame of the trails shown; enable Trail Range Slider before generating")
+        ModernTooltip(self.range_end, "Last frame of the trails shown; enable Trail Range Slider before generating")
+        ModernTooltip(self.save_range_button, "Save the selected range next to the full star trail")
+        self.set_range_controls(False)
         
         # Process buttons and progress
         button_frame = ttk.Frame(main_tab)
@@ -445,6 +2872,20 @@ class StarTrailGenerator:
         self.process_button.pack(side=tk.RIGHT, padx=5)
         ModernTooltip(self.process_button, "Start processing images to create star trails")
         
+        self.cancel_button = ttk.Button(button_frame, text="Cancel", command=self.cancel_processing,
+                                       state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.RIGHT, padx=5)
+        ModernTooltip(self.cancel_button, "Stop after the current frame and offer to save the partial star trail")
+        
+        self.pause_button = ttk.Button(button_frame, text="Pause", command=self.toggle_pause,
+                                      state=tk.DISABLED)
+        self.pause_button.pack(side=tk.RIGHT, padx=5)
+        ModernTooltip(self.pause_button, "Pause processing and free the CPU until resumed")
+        
+        self.analyze_button = ttk.Button(button_frame, text="Analyze Frames", command=self.analyze_frames)
+        self.analyze_button.pack(side=tk.RIGHT, padx=5)
+        ModernTooltip(self.analyze_button, "Quickly scan thumbnails for aircraft, clouds and headlights so bad frames can be excluded")
+        
         # Status bar
         status_bar = ttk.Label(main_tab, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
         status_bar.pack(side=tk.BOTTOM, fill=tk.X)
@@ -511,7 +2952,126 @@ class StarTrailGenerator:
         
         ttk.Label(size_card, text="Choose how to handle images with different dimensions",
                 wraplength=300).pack(anchor=tk.W, pady=(5, 0))
+
+        # Left column - Trail Style card
+        trail_card = ttk.Frame(left_column, style="Card.TFrame", padding=15)
+        trail_card.pack(fill=tk.X, pady=(15, 0))
+
+        ttk.Label(trail_card, text="Trail Style", style="Heading.TLabel").pack(anchor=tk.W, pady=(0, 10))
+
+        style_frame = ttk.Frame(trail_card)
+        style_frame.pack(fill=tk.X, pady=5)
+
+        ttk.Label(style_frame, text="Stacking Mode:").pack(side=tk.LEFT)
+        style_dropdown = ttk.Combobox(style_frame, textvariable=self.trail_style,
+                                      values=["Maximum", "Comet"], width=10, state="readonly")
+        style_dropdown.pack(side=tk.LEFT, padx=10)
+        ModernTooltip(style_dropdown, "Maximum keeps every trail at full brightness, Comet fades older frames out")
+
+        tail_frame = ttk.Frame(trail_card)
+        tail_frame.pack(fill=tk.X, pady=5)
+
+        ttk.Label(tail_frame, text="Comet Tail Length (frames):").pack(side=tk.LEFT)
+        self.comet_length = ttk.Spinbox(tail_frame, from_=2, to=1000, increment=5, width=5)
+        self.comet_length.insert(0, "30")
+        self.comet_length.pack(side=tk.LEFT, padx=10)
+
+        gap_switch = CustomSwitch(trail_card, text="Fill Gaps Between Frames", variable=self.fill_gaps)
+        gap_switch.pack(anchor=tk.W, pady=5)
+        ModernTooltip(gap_switch, "Close the small dotted gaps left by the pause between exposures")
+
+        gap_frame = ttk.Frame(trail_card)
+        gap_frame.pack(fill=tk.X, pady=5)
+
+        ttk.Label(gap_frame, text="Gap Size (px):").pack(side=tk.LEFT)
+        self.gap_size = ttk.Spinbox(gap_frame, from_=1, to=10, increment=1, width=5)
+        self.gap_size.insert(0, "2")
+        self.gap_size.pack(side=tk.LEFT, padx=10)
+
+        exclusion_switch = CustomSwitch(trail_card, text="Instant Frame Exclusion", variable=self.instant_exclusion)
+        exclusion_switch.pack(anchor=tk.W, pady=5)
+        ModernTooltip(exclusion_switch, "Keep the brightest few values of every pixel, so frames excluded after stacking are removed in under a second without re-reading any image (Maximum mode only)")
+
+        depth_frame = ttk.Frame(trail_card)
+        depth_frame.pack(fill=tk.X, pady=5)
+
+        ttk.Label(depth_frame, text="Values Kept per Pixel:").pack(side=tk.LEFT)
+        self.top_k_depth = ttk.Spinbox(depth_frame, from_=2, to=16, increment=1, width=5)
+        self.top_k_depth.insert(0, "4")
+        self.top_k_depth.pack(side=tk.LEFT, padx=10)
+        ModernTooltip(self.top_k_depth, "How many frames can overlap at one pixel and still be excluded exactly. Each value costs 3 bytes per pixel and channel")
+
+        range_switch = CustomSwitch(trail_card, text="Trail Range Slider", variable=self.trail_range)
+        range_switch.pack(anchor=tk.W, pady=5)
+        ModernTooltip(range_switch, "Keep partial stacks while stacking, so the sliders under the preview can show any part of the night without re-reading any image (Maximum mode only)")
+
+        blocks_frame = ttk.Frame(trail_card)
+        blocks_frame.pack(fill=tk.X, pady=5)
+
+        ttk.Label(blocks_frame, text="Range Steps:").pack(side=tk.LEFT)
+        self.range_blocks = ttk.Combobox(blocks_frame, values=["8", "16", "32", "64"], width=5, state="readonly")
+        self.range_blocks.set("16")
+        self.range_blocks.pack(side=tk.LEFT, padx=10)
+        ModernTooltip(self.range_blocks, "How finely the night is divided for the range sliders. Each step costs about 2 bytes per pixel and channel: at 24 MP, 16 steps take about 2.2 GB and 64 steps about 9 GB (memory-mapped to disk when over the memory budget)")
+
+        # Bind traces to update control states
+        self.trail_style.trace_add("write", self.update_trail_controls)
+        self.fill_gaps.trace_add("write", self.update_trail_controls)
+        self.instant_exclusion.trace_add("write", self.update_trail_controls)
+        self.trail_range.trace_add("write", self.update_trail_controls)
+        
+        # Left column - Alignment card
+        align_card = ttk.Frame(left_column, style="Card.TFrame", padding=15)
+        align_card.pack(fill=tk.X, pady=(15, 0))
+        
+        ttk.Label(align_card, text="Alignment", style="Heading.TLabel").pack(anchor=tk.W, pady=(0, 10))
+        
+        align_switch = CustomSwitch(align_card, text="Correct Tripod Drift", variable=self.align_frames)
+        align_switch.pack(anchor=tk.W, pady=5)
+        ModernTooltip(align_switch, "Align every frame to the first one using the foreground, so wind or tripod creep does not smear it")
+        
+        foreground_frame = ttk.Frame(align_card)
+        foreground_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(foreground_frame, text="Foreground Height (%):").pack(side=tk.LEFT)
+        self.foreground_percent = ttk.Spinbox(foreground_frame, from_=5, to=100, increment=5, width=5)
+        self.foreground_percent.insert(0, "35")
+        self.foreground_percent.pack(side=tk.LEFT, padx=10)
+        
+        ttk.Label(align_card, text="Drift is measured on the bottom part of the frame. Transforms are cached, so re-runs of the same session start stacking immediately.",
+                wraplength=300).pack(anchor=tk.W, pady=(5, 0))
         
+        # Left column - Video Input card
+        video_card = ttk.Frame(left_column, style="Card.TFrame", padding=15)
+        video_card.pack(fill=tk.X, pady=(15, 0))
+        
+        ttk.Label(video_card, text="Video Input", style="Heading.TLabel").pack(anchor=tk.W, pady=(0, 10))
+        
+        stride_frame = ttk.Frame(video_card)
+        stride_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(stride_frame, text="Use Every Nth Frame:").pack(side=tk.LEFT)
+        self.video_stride = ttk.Spinbox(stride_frame, from_=1, to=1000, increment=1, width=5)
+        self.video_stride.insert(0, "1")
+        self.video_stride.pack(side=tk.LEFT, padx=10)
+        
+        window_frame = ttk.Frame(video_card)
+        window_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(window_frame, text="From (s):").pack(side=tk.LEFT)
+        self.video_start = ttk.Entry(window_frame, width=7)
+        self.video_start.insert(0, "0")
+        self.video_start.pack(side=tk.LEFT, padx=(10, 15))
+        
+        ttk.Label(window_frame, text="To (s):").pack(side=tk.LEFT)
+        self.video_end = ttk.Entry(window_frame, width=7)
+        self.video_end.insert(0, "0")
+        self.video_end.pack(side=tk.LEFT, padx=10)
+        ModernTooltip(self.video_end, "0 stacks until the end of the video")
+        
+        ttk.Label(video_card, text="Frames are decoded in order on a background thread and stacked as they arrive, so even long videos use little memory.",
+                wraplength=300).pack(anchor=tk.W, pady=(5, 0))
+
         # Right column - RAW processing card
         raw_card = ttk.Frame(right_column, style="Card.TFrame", padding=15)
         raw_card.pack(fill=tk.X, pady=(0, 15))
@@ -524,9 +3084,53 @@ class StarTrailGenerator:
         bright_switch = CustomSwitch(raw_card, text="No Auto Brightness", variable=self.no_auto_bright)
         bright_switch.pack(anchor=tk.W, pady=5)
         
-        ttk.Label(raw_card, text="These settings control how RAW files (ARW) are processed. Adjust them to get the best results for your specific camera and photography conditions.",
+        ttk.Label(raw_card, text="These settings control how RAW files (ARW, CR2, CR3, NEF, RAF, DNG, ...) are processed. Adjust them to get the best results for your specific camera and photography conditions.",
+                wraplength=300).pack(anchor=tk.W, pady=(5, 0))
+        
+        # Right column - Dark frame calibration card
+        dark_card = ttk.Frame(right_column, style="Card.TFrame", padding=15)
+        dark_card.pack(fill=tk.X, pady=(0, 15))
+        
+        ttk.Label(dark_card, text="Dark Frame Calibration", style="Heading.TLabel").pack(anchor=tk.W, pady=(0, 10))
+        
+        dark_switch = CustomSwitch(dark_card, text="Subtract Dark Frames", variable=self.use_darks)
+        dark_switch.pack(anchor=tk.W, pady=5)
+        ModernTooltip(dark_switch, "Remove thermal noise and hot pixels using dark frames shot with the lens cap on")
+        
+        dark_folder_frame = ttk.Frame(dark_card)
+        dark_folder_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(dark_folder_frame, text="Dark Folder:").pack(side=tk.LEFT)
+        self.dark_entry = ttk.Entry(dark_folder_frame)
+        self.dark_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=10)
+        ttk.Button(dark_folder_frame, text="Browse...", command=self.browse_dark_folder).pack(side=tk.LEFT)
+        
+        ttk.Label(dark_card, text="Master darks are cached per camera, ISO, exposure and temperature. Leave the folder empty to reuse a cached master that matches your images.",
                 wraplength=300).pack(anchor=tk.W, pady=(5, 0))
         
+        # Right column - Performance card
+        performance_card = ttk.Frame(right_column, style="Card.TFrame", padding=15)
+        performance_card.pack(fill=tk.X, pady=(0, 15))
+        
+        ttk.Label(performance_card, text="Performance", style="Heading.TLabel").pack(anchor=tk.W, pady=(0, 10))
+        
+        budget_frame = ttk.Frame(performance_card)
+        budget_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(budget_frame, text="Memory Budget (GB):").pack(side=tk.LEFT)
+        budget_spinbox = ttk.Spinbox(budget_frame, from_=0, to=512, increment=1, width=5,
+                                     textvariable=self.memory_budget_gb)
+        budget_spinbox.pack(side=tk.LEFT, padx=10)
+        ModernTooltip(budget_spinbox, "0 sizes decoding to the memory that is currently free")
+        
+        ttk.Label(performance_card, text="Decode workers, read-ahead, GIF buffering and memory-mapped stacking are chosen automatically to stay within this budget.",
+                wraplength=300).pack(anchor=tk.W, pady=(5, 0))
+        
+        self.benchmark_button = ttk.Button(performance_card, text="Benchmark Decoders",
+                                           command=self.benchmark_decoders)
+        self.benchmark_button.pack(anchor=tk.W, pady=(10, 0))
+        ModernTooltip(self.benchmark_button, "Time every decoder on the selected images and use the fastest one for each format")
+        
         # Right column - About card
         about_card = ttk.Frame(right_column, style="Card.TFrame", padding=15)
         about_card.pack(fill=tk.X)
@@ -540,6 +3144,105 @@ The application works by finding the brightest pixel values across your image se
 For best results, use a tripod and consistent camera settings for all source images."""
         
         ttk.Label(about_card, text=about_text, wraplength=300).pack(anchor=tk.W)
+        
+        # ---- Batch Queue Tab Content ----
+        self.setup_queue_tab(queue_tab)
+    
+    def setup_queue_tab(self, queue_tab):
+        """Create the batch queue list and its controls"""
+        queue_card = ttk.Frame(queue_tab, style="Card.TFrame", padding=15)
+        queue_card.pack(fill=tk.BOTH, expand=True)
+        
+        ttk.Label(queue_card, text="Batch Queue", style="Heading.TLabel").pack(anchor=tk.W, pady=(0, 10))
+        
+        budget_gb = self.job_queue.memory_budget / 1024 ** 3
+        ttk.Label(queue_card, text=f"Sessions run up to {self.job_queue.max_concurrent} at a time within a "
+                                   f"{budget_gb:.1f} GB memory budget. Each session keeps the output settings "
+                                   f"that were active when it was added, and the queue is restored on restart.",
+                 wraplength=700).pack(anchor=tk.W, pady=(0, 10))
+        
+        # Queue controls
+        queue_buttons = ttk.Frame(queue_card)
+        queue_buttons.pack(side=tk.BOTTOM, fill=tk.X, pady=(10, 0))
+        
+        add_folder_btn = ttk.Button(queue_buttons, text="Add Session Folder...", command=self.add_queue_folder)
+        add_folder_btn.pack(side=tk.LEFT, padx=(0, 5))
+        ModernTooltip(add_folder_btn, "Queue a folder using the current output and stacking settings")
+        ttk.Button(queue_buttons, text="Add Current Session", command=self.add_current_session).pack(side=tk.LEFT, padx=5)
+        ttk.Button(queue_buttons, text="Remove", command=self.remove_queue_selection).pack(side=tk.LEFT, padx=5)
+        ttk.Button(queue_buttons, text="Cancel", command=self.cancel_queue_selection).pack(side=tk.LEFT, padx=5)
+        ttk.Button(queue_buttons, text="Clear Finished", command=self.job_queue.clear_finished).pack(side=tk.LEFT, padx=5)
+        
+        self.queue_start_button = ttk.Button(queue_buttons, text="Start Queue", command=self.toggle_queue,
+                                             style="Accent.TButton")
+        self.queue_start_button.pack(side=tk.RIGHT, padx=5)
+        
+        # Job list
+        columns = ("images", "output", "state", "progress", "message")
+        self.queue_tree = ttk.Treeview(queue_card, columns=columns, selectmode="extended")
+        self.queue_tree.heading("#0", text="Session")
+        self.queue_tree.heading("images", text="Images")
+        self.queue_tree.heading("output", text="Output")
+        self.queue_tree.heading("state", text="State")
+        self.queue_tree.heading("progress", text="Progress")
+        self.queue_tree.heading("message", text="Status")
+        self.queue_tree.column("#0", width=220)
+        self.queue_tree.column("images", width=70, anchor=tk.E)
+        self.queue_tree.column("output", width=180)
+        self.queue_tree.column("state", width=80)
+        self.queue_tree.column("progress", width=80, anchor=tk.E)
+        self.queue_tree.column("message", width=300)
+        
+        queue_scrollbar = ttk.Scrollbar(queue_card, orient=tk.VERTICAL, command=self.queue_tree.yview)
+        self.queue_tree.configure(yscrollcommand=queue_scrollbar.set)
+        queue_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.queue_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+    
+    def schedule_queue_refresh(self):
+        """Coalesce queue updates from worker threads into one refresh on the UI thread"""
+        if not self._queue_refresh_pending:
+            self._queue_refresh_pending = True
+            self.root.after(100, self.refresh_queue)
+    
+    def refresh_queue(self):
+        self._queue_refresh_pending = False
+        selection = self.queue_tree.selection()
+        self.queue_tree.delete(*self.queue_tree.get_children())
+        for job in list(self.job_queue.jobs):
+            images = len(job.image_files) if job.image_files is not None else "folder"
+            self.queue_tree.insert("", tk.END, iid=job.job_id, text=job.input_folder, values=(
+                images, os.path.join(job.output_folder, job.options["image_filename"]),
+                job.state, f"{job.progress}%", job.message))
+        self.queue_tree.selection_set([iid for iid in selection if self.queue_tree.exists(iid)])
+        self.queue_start_button.config(text="Stop Queue" if self.job_queue.active else "Start Queue")
+    
+    def add_queue_folder(self):
+        folder = filedialog.askdirectory(title="Select a session folder to queue")
+        if folder:
+            self.job_queue.add(StackJob(folder, folder, self.collect_options()))
+            CustomNotification(self.root, f"Queued {os.path.basename(folder)}", "info")
+    
+    def add_current_session(self):
+        if not self.image_files or not self.output_folder:
+            CustomNotification(self.root, "Select an input and output folder first.", "error")
+            return
+        self.job_queue.add(StackJob(self.image_folder, self.output_folder, self.collect_options(),
+                                    image_files=list(self.image_files)))
+        CustomNotification(self.root, "Current session added to the queue", "info")
+    
+    def remove_queue_selection(self):
+        for job_id in self.queue_tree.selection():
+            self.job_queue.remove(job_id)
+    
+    def cancel_queue_selection(self):
+        for job_id in self.queue_tree.selection():
+            self.job_queue.cancel(job_id)
+    
+    def toggle_queue(self):
+        if self.job_queue.active:
+            self.job_queue.stop()
+        else:
+            self.job_queue.start()
     
     def show_about(self):
         """Show about dialog"""
@@ -591,10 +3294,15 @@ For best results, use a tripod and consistent camera settings for all source ima
             self.output_entry.insert(0, folder)
             self.output_folder = folder
             
+            self.restack_pipeline = None
+            self.set_range_pipeline(None)
+            
             # Count images in folder
             self.image_files = sorted([os.path.join(folder, f) for f in os.listdir(folder) 
-                                     if f.lower().endswith(('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.arw'))])
+                                     if f.lower().endswith(DECODERS.extensions())])
+            self.excluded_files = set()
             self.status_var.set(f"Found {len(self.image_files)} images in selected folder")
+            self.load_thumbnail_strip()
             
             # Show notification
             if len(self.image_files) > 0:
@@ -602,6 +3310,263 @@ For best results, use a tripod and consistent camera settings for all source ima
             else:
                 CustomNotification(self.root, "No supported images found in folder", "warning")
     
+    def browse_video(self):
+        video_types = " ".join(f"*{ext}" for ext in VIDEO_EXTENSIONS)
+        path = filedialog.askopenfilename(title="Select a video of the night sky",
+                                          filetypes=[("Video files", video_types), ("All files", "*.*")])
+        if path:
+            try:
+                video = VideoSource(path)
+            except IOError as e:
+                CustomNotification(self.root, str(e), "error")
+                return
+            
+            folder = os.path.dirname(path)
+            self.image_folder = path
+            self.folder_entry.delete(0, tk.END)
+            self.folder_entry.insert(0, path)
+            self.output_entry.delete(0, tk.END)
+            self.output_entry.insert(0, folder)
+            self.output_folder = folder
+            
+            self.restack_pipeline = None
+            self.set_range_pipeline(None)
+            
+            # The video itself is the only input; frames are streamed from it when stacking
+            self.image_files = [path]
+            self.excluded_files = set()
+            self.load_thumbnail_strip()
+            
+            duration = len(video) / video.fps
+            self.status_var.set(f"Video: {len(video)} frames, {video.width}x{video.height}, "
+                                f"{video.fps:.2f} fps ({duration:.0f} s)")
+            CustomNotification(self.root, f"Found {len(video)} video frames", "info")
+    
+    def is_video_input(self):
+        return bool(self.image_files) and is_video_file(self.image_files[0])
+    
+    def load_thumbnail_strip(self):
+        """Fill the sequence strip from cached or freshly decoded thumbnails in the background"""
+        self._strip_generation += 1
+        self.strip_canvas.delete("all")
+        self.strip_images = {}
+        self.strip_canvas.configure(scrollregion=(0, 0, len(self.image_files) * STRIP_SLOT_WIDTH, STRIP_HEIGHT + 8))
+        self.strip_canvas.xview_moveto(0)
+        if self.image_files and not self.is_video_input():
+            threading.Thread(target=self._strip_thread, args=(list(self.image_files), self._strip_generation),
+                             daemon=True).start()
+    
+    def _strip_thread(self, image_files, generation):
+        cache = ThumbnailCache()
+        
+        def load(img_path):
+            img = cache.load(img_path)
+            # Shrink to the strip slot here so the UI thread only wraps pixels
+            scale = min((STRIP_SLOT_WIDTH - 6) / img.shape[1], STRIP_HEIGHT / img.shape[0])
+            img = cv2.resize(img, (max(1, int(img.shape[1] * scale)), max(1, int(img.shape[0] * scale))),
+                             interpolation=cv2.INTER_AREA)
+            return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        
+        executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
+        try:
+            futures = {executor.submit(load, path): i for i, path in enumerate(image_files)}
+            batch = []
+            for future in as_completed(futures):
+                if generation != self._strip_generation:
+                    return  # Another folder was opened
+                try:
+                    batch.append((futures[future], future.result()))
+                except Exception as e:
+                    print(f"Thumbnail error: {str(e)}")
+                if len(batch) >= 32:
+                    self.root.after(0, self.add_strip_thumbnails, batch, generation)
+                    batch = []
+            if batch:
+                self.root.after(0, self.add_strip_thumbnails, batch, generation)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def add_strip_thumbnails(self, batch, generation):
+        if generation != self._strip_generation:
+            return
+        for index, rgb_image in batch:
+            photo = ImageTk.PhotoImage(image=Image.fromarray(rgb_image))
+            self.strip_images[index] = photo
+            self.strip_canvas.create_image(index * STRIP_SLOT_WIDTH + STRIP_SLOT_WIDTH // 2, STRIP_HEIGHT // 2 + 4,
+                                           image=photo, tags=("thumb",))
+        self.refresh_strip_marks()
+    
+    def refresh_strip_marks(self):
+        """Cross out excluded frames in the sequence strip"""
+        self.strip_canvas.delete("excluded")
+        for index, img_path in enumerate(self.image_files):
+            if img_path in self.excluded_files:
+                x0 = index * STRIP_SLOT_WIDTH + 3
+                x1 = x0 + STRIP_SLOT_WIDTH - 6
+                self.strip_canvas.create_rectangle(x0, 2, x1, STRIP_HEIGHT + 6, outline=COLOR_SCHEME["light"]["error"],
+                                                   width=3, tags=("excluded",))
+                self.strip_canvas.create_line(x0, 2, x1, STRIP_HEIGHT + 6, fill=COLOR_SCHEME["light"]["error"],
+                                              width=2, tags=("excluded",))
+    
+    def strip_index_at(self, event):
+        index = int(self.strip_canvas.canvasx(event.x) // STRIP_SLOT_WIDTH)
+        return index if 0 <= index < len(self.image_files) else None
+    
+    def on_strip_click(self, event):
+        index = self.strip_index_at(event)
+        if index is not None:
+            img_path = self.image_files[index]
+            state = " (excluded)" if img_path in self.excluded_files else ""
+            self.status_var.set(f"Frame {index + 1}/{len(self.image_files)}: {os.path.basename(img_path)}{state}")
+    
+    def on_strip_double_click(self, event):
+        index = self.strip_index_at(event)
+        if index is None:
+            return
+        img_path = self.image_files[index]
+        if img_path in self.excluded_files:
+            self.excluded_files.discard(img_path)
+        else:
+            self.excluded_files.add(img_path)
+        self.exclusions_changed()
+    
+    def exclusions_changed(self):
+        """Refresh the strip and status after exclusions change, re-stacking at once when possible"""
+        self.refresh_strip_marks()
+        kept = len(self.image_files) - len(self.excluded_files)
+        self.status_var.set(f"Stacking {kept} of {len(self.image_files)} images ({len(self.excluded_files)} excluded)")
+        if self.restack_pipeline is not None:
+            self._restack_generation += 1
+            threading.Thread(target=self._restack_thread, args=(self._restack_generation,), daemon=True).start()
+    
+    def _restack_thread(self, generation):
+        with self._restack_lock:
+            if generation != self._restack_generation:
+                return  # A newer exclusion change supersedes this one
+            pipeline = self.restack_pipeline
+            excluded = set(self.excluded_files)
+            try:
+                start = time.perf_counter()
+                unresolved = pipeline.restack(excluded)
+                elapsed = time.perf_counter() - start
+                self.final_image = pipeline.final_image
+                self.update_preview(pipeline.final_image)
+                pipeline.export([], include_gif=False)  # The GIF keeps every frame until the next run
+            except Exception as e:
+                traceback.print_exc()
+                self.status_var.set(f"Error: {str(e)}")
+                CustomNotification(self.root, f"Re-stacking failed: {str(e)}", "error")
+                return
+            
+            removed = len(excluded.intersection(pipeline.frame_labels))
+            message = f"Re-stacked without {removed} frames in {elapsed:.2f} s and saved"
+            if unresolved:
+                message += (f"; {unresolved} pixels lost more than {pipeline.top_k.k} of their brightest frames, "
+                            f"generate again for an exact result")
+            if self.range_pipeline is not None:
+                self.root.after(0, lambda: self.set_range_controls(True))  # The preview is the whole night again
+            readded = len(self.stacked_excluded - excluded)
+            if readded:
+                message += f"; generate again to add back {readded} frames"
+            self.status_var.set(message)
+    
+    def set_range_pipeline(self, pipeline):
+        """Remember the stack the range sliders draw from and reset them to the whole night"""
+        self.range_pipeline = pipeline
+        self._range_generation += 1
+        enabled = pipeline is not None
+        self.root.after(0, lambda: self.set_range_controls(enabled))
+    
+    def set_range_controls(self, enabled):
+        """Spread the range sliders over every stacked frame, or disable them"""
+        pipeline = self.range_pipeline if enabled else None
+        count = pipeline.range_tree.count if pipeline is not None else 0
+        # Scale.set runs the slider command, which must not start a re-stack here
+        self._range_resetting = True
+        try:
+            for scale, value in ((self.range_start, 0), (self.range_end, max(0, count - 1))):
+                scale.config(to=max(1, count - 1))
+                scale.set(value)
+                scale.state(["!disabled"] if count else ["disabled"])
+        finally:
+            self._range_resetting = False
+        self.save_range_button.config(state=tk.NORMAL if count else tk.DISABLED)
+        self.range_label.config(text=f"1–{count} of {count}" if count else "")
+    
+    def selected_range(self):
+        return int(round(float(self.range_start.get()))), int(round(float(self.range_end.get())))
+    
+    def on_range_change(self, moved):
+        """Keep the start before the end and show the chosen range, stacked in the background"""
+        if self._range_resetting or self.range_pipeline is None:
+            return
+        start, end = self.selected_range()
+        if start > end:
+            # The slider being dragged pushes the other one along
+            self._range_resetting = True
+            try:
+                if moved == "start":
+                    end = start
+                    self.range_end.set(end)
+                else:
+                    start = end
+                    self.range_start.set(start)
+            finally:
+                self._range_resetting = False
+        self._range_generation += 1
+        threading.Thread(target=self._range_thread, args=(self._range_generation, start, end), daemon=True).start()
+    
+    def _range_thread(self, generation, start, end):
+        with self._restack_lock:
+            if generation != self._range_generation:
+                return  # The sliders have moved on since
+            pipeline = self.range_pipeline
+            try:
+                first, last = pipeline.stack_range(start, end)
+                self.final_image = pipeline.final_image
+                self.update_preview(pipeline.final_image)
+            except Exception as e:
+                traceback.print_exc()
+                self.status_var.set(f"Error: {str(e)}")
+                return
+            
+            labels = pipeline.frame_labels
+            self.range_label.config(text=f"{first + 1}–{last + 1} of {pipeline.range_tree.count}")
+            message = (f"Showing frames {first + 1}–{last + 1}: {os.path.basename(labels[first])} to "
+                       f"{os.path.basename(labels[last])}")
+            if self.excluded_files.intersection(labels[first:last + 1]):
+                message += "; frames excluded after stacking are still included"
+            self.status_var.set(message)
+    
+    def save_trail_range(self):
+        if self.range_pipeline is not None:
+            threading.Thread(target=self._save_range_thread, args=self.selected_range(), daemon=True).start()
+    
+    def _save_range_thread(self, start, end):
+        with self._restack_lock:
+            pipeline = self.range_pipeline
+            if pipeline is None:
+                return
+            try:
+                first, last = pipeline.stack_range(start, end)
+                output_paths = pipeline.export_range(first, last)
+            except Exception as e:
+                traceback.print_exc()
+                self.status_var.set(f"Error: {str(e)}")
+                CustomNotification(self.root, f"Could not save the trail range: {str(e)}", "error")
+                return
+            self.status_var.set(f"Frames {first + 1}–{last + 1} saved to {output_paths[0]}")
+            CustomNotification(self.root, "Trail range saved", "success")
+    
+    def browse_dark_folder(self):
+        folder = filedialog.askdirectory(title="Select folder containing dark frames")
+        if folder:
+            self.dark_folder = folder
+            self.dark_entry.delete(0, tk.END)
+            self.dark_entry.insert(0, folder)
+            self.use_darks.set(True)
+            CustomNotification(self.root, "Dark frame folder set", "info")
+    
     def browse_output(self):
         folder = filedialog.askdirectory(title="Select output folder")
         if folder:
@@ -611,56 +3576,275 @@ For best results, use a tripod and consistent camera settings for all source ima
             CustomNotification(self.root, f"Output folder set", "info")
     
     def update_preview(self, img):
+        """Fold a new stack image into the preview pyramid and redraw the visible tiles
+
+        Safe to call from the processing thread: the pyramid is updated in place
+        and drawing is handed to the UI thread.
+        """
         if img is None:
             return
-            
+        
+        try:
+            first = self.preview_pyramid.shape != img.shape[:2]
+            self.preview_pyramid.update(img)
+            if first:
+                self.preview_fit = True
+            self.schedule_preview_render()
+        except Exception as e:
+            print(f"Preview update error: {str(e)}")
+            # Don't let preview errors crash the application
+    
+    def schedule_preview_render(self):
+        """Coalesce redraw requests into a single render on the UI thread"""
+        if not self._preview_render_pending:
+            self._preview_render_pending = True
+            self.root.after(0, self.render_preview)
+    
+    def get_canvas_size(self):
+        canvas_width = self.canvas.winfo_width()
+        canvas_height = self.canvas.winfo_height()
+        
+        # Use default size if canvas not yet sized
+        if canvas_width <= 1 or canvas_height <= 1:
+            canvas_width = 640
+            canvas_height = 480
+        return canvas_width, canvas_height
+    
+    def render_preview(self):
+        """Draw the tiles visible at the current zoom and pan position"""
+        self._preview_render_pending = False
+        pyramid = self.preview_pyramid
+        if pyramid.shape is None:
+            return
+        
         try:
-            # Make a copy to avoid any threading issues
-            img = img.copy()
+            canvas_width, canvas_height = self.get_canvas_size()
+            img_height, img_width = pyramid.shape
             
-            # Resize for preview while maintaining aspect ratio
-            canvas_width = self.canvas.winfo_width()
-            canvas_height = self.canvas.winfo_height()
+            if self.preview_fit:
+                self.preview_scale = min(canvas_width / img_width, canvas_height / img_height)
+                self.preview_center = (img_width / 2, img_height / 2)
+            scale = self.preview_scale
             
-            # Use default size if canvas not yet sized
-            if canvas_width <= 1 or canvas_height <= 1:
-                canvas_width = 640
-                canvas_height = 480
+            # Tiles of the chosen level cover tile_span image pixels and tile_size screen pixels
+            level = pyramid.level_for_scale(scale)
+            factor = 2 ** level
+            tile_span = PreviewPyramid.TILE_SIZE * factor
+            tile_size = max(1, round(tile_span * scale))
             
-            img_height, img_width = img.shape[:2]
+            left = self.preview_center[0] - canvas_width / (2 * scale)
+            top = self.preview_center[1] - canvas_height / (2 * scale)
+            origin_x = round(-left * scale)
+            origin_y = round(-top * scale)
             
-            # Calculate scaling factor
-            scale = min(canvas_width / img_width, canvas_height / img_height)
+            columns, rows = pyramid.tile_grid(level)
+            first_tx = max(0, int(left // tile_span))
+            first_ty = max(0, int(top // tile_span))
+            last_tx = min(columns - 1, int((left + canvas_width / scale) // tile_span))
+            last_ty = min(rows - 1, int((top + canvas_height / scale) // tile_span))
             
-            # Resize image for display
-            if scale < 1:
-                new_width = int(img_width * scale)
-                new_height = int(img_height * scale)
-                resized = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
-            else:
-                new_width = int(img_width * scale)
-                new_height = int(img_height * scale)
-                resized = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+            # Cached tiles from other zoom levels are no longer useful
+            self.preview_tiles = {key: value for key, value in self.preview_tiles.items()
+                                  if key[0] == level and value[0][1] == tile_size}
             
-            # Convert from BGR to RGB for PIL
-            rgb_image = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
+            self.canvas.delete("all")
+            for ty in range(first_ty, last_ty + 1):
+                for tx in range(first_tx, last_tx + 1):
+                    key = (level, tx, ty)
+                    version = pyramid.versions.get(key, 0)
+                    cached = self.preview_tiles.get(key)
+                    if cached is None or cached[0] != (version, tile_size):
+                        data, version = pyramid.tile(level, tx, ty)
+                        width = max(1, round(data.shape[1] * factor * scale))
+                        height = max(1, round(data.shape[0] * factor * scale))
+                        interpolation = cv2.INTER_AREA if factor * scale < 1 else cv2.INTER_NEAREST
+                        resized = cv2.resize(data, (width, height), interpolation=interpolation)
+                        cached = ((version, tile_size), ImageTk.PhotoImage(image=Image.fromarray(resized)))
+                        self.preview_tiles[key] = cached
+                    
+                    self.canvas.create_image(origin_x + tx * tile_size, origin_y + ty * tile_size,
+                                             anchor=tk.NW, image=cached[1])
             
-            # Convert to PhotoImage
-            pil_img = Image.fromarray(rgb_image)
-            self.preview_image = ImageTk.PhotoImage(image=pil_img)
+            self.zoom_label.config(text=f"{scale * 100:.0f}%")
             
-            # Clear canvas and display new image
-            self.canvas.delete("all")
+        except Exception as e:
+            print(f"Preview render error: {str(e)}")
+            # Don't let preview errors crash the application
+    
+    def set_preview_zoom(self, scale, anchor=None):
+        """Zoom to a scale, keeping the image point under the anchor (canvas x, y) fixed"""
+        if self.preview_pyramid.shape is None:
+            return
+        canvas_width, canvas_height = self.get_canvas_size()
+        img_height, img_width = self.preview_pyramid.shape
+        fit_scale = min(canvas_width / img_width, canvas_height / img_height)
+        scale = min(max(scale, min(fit_scale, 1.0) / 2), 16.0)
+        
+        if anchor is None:
+            anchor = (canvas_width / 2, canvas_height / 2)
+        old_scale = self.preview_scale
+        center_x, center_y = self.preview_center
+        image_x = center_x + (anchor[0] - canvas_width / 2) / old_scale
+        image_y = center_y + (anchor[1] - canvas_height / 2) / old_scale
+        
+        self.preview_fit = False
+        self.preview_scale = scale
+        self.preview_center = (image_x - (anchor[0] - canvas_width / 2) / scale,
+                               image_y - (anchor[1] - canvas_height / 2) / scale)
+        self.schedule_preview_render()
+    
+    def fit_preview(self):
+        self.preview_fit = True
+        self.schedule_preview_render()
+    
+    def on_preview_wheel(self, event):
+        zoom_in = event.num == 4 or getattr(event, "delta", 0) > 0
+        self.set_preview_zoom(self.preview_scale * (1.25 if zoom_in else 0.8), (event.x, event.y))
+    
+    def on_preview_press(self, event):
+        self.preview_drag = (event.x, event.y)
+    
+    def on_preview_drag(self, event):
+        if self.preview_drag is None or self.preview_pyramid.shape is None:
+            return
+        dx = event.x - self.preview_drag[0]
+        dy = event.y - self.preview_drag[1]
+        self.preview_drag = (event.x, event.y)
+        self.preview_fit = False
+        self.preview_center = (self.preview_center[0] - dx / self.preview_scale,
+                               self.preview_center[1] - dy / self.preview_scale)
+        self.schedule_preview_render()
+    
+    def on_preview_double_click(self, event):
+        if self.preview_fit:
+            self.set_preview_zoom(1.0, (event.x, event.y))
+        else:
+            self.fit_preview()
+    
+    def analyze_frames(self):
+        if not self.image_files:
+            CustomNotification(self.root, "No images selected. Please select a folder with images.", "error")
+            return
+        if self.is_video_input():
+            CustomNotification(self.root, "This works on folders of images, not on video input.", "warning")
+            return
+        
+        self.analyze_button.config(state=tk.DISABLED)
+        self.progress['value'] = 0
+        threading.Thread(target=self._analyze_thread, daemon=True).start()
+    
+    def _analyze_thread(self):
+        try:
+            self.status_var.set("Analyzing frame thumbnails...")
             
-            # Center the image
-            x_pos = (canvas_width - self.preview_image.width()) // 2
-            y_pos = (canvas_height - self.preview_image.height()) // 2
+            def report(done, total):
+                self.progress['value'] = int(done / total * 100)
+                self.status_var.set(f"Analyzing thumbnail {done}/{total}...")
+            
+            results = FrameAnalyzer().analyze(self.image_files, report)
+            flagged = sum(1 for r in results if r["flags"])
+            self.status_var.set(f"Analysis complete: {flagged} of {len(results)} frames look like outliers")
+            self.root.after(0, lambda: self.show_analysis_results(results))
+        except Exception as e:
+            traceback.print_exc()
+            self.status_var.set(f"Error: {str(e)}")
+            CustomNotification(self.root, f"Frame analysis failed: {str(e)}", "error")
+        finally:
+            self.analyze_button.config(state=tk.NORMAL)
+    
+    def benchmark_decoders(self):
+        if not self.image_files:
+            CustomNotification(self.root, "No images selected. Please select a folder with images.", "error")
+            return
+        if self.is_video_input():
+            CustomNotification(self.root, "This works on folders of images, not on video input.", "warning")
+            return
+        
+        self.benchmark_button.config(state=tk.DISABLED)
+        self.progress['value'] = 0
+        threading.Thread(target=self._benchmark_thread, args=(self.collect_options(),), daemon=True).start()
+    
+    def _benchmark_thread(self, options):
+        try:
+            self.status_var.set("Benchmarking decoders...")
             
-            self.canvas.create_image(x_pos, y_pos, anchor=tk.NW, image=self.preview_image)
+            def report(done, total):
+                self.progress['value'] = int(done / total * 100)
+                self.status_var.set(f"Benchmarked format {done}/{total}...")
             
+            results = DECODERS.benchmark(self.image_files, options, progress_callback=report)
+            lines = []
+            for ext, timings in sorted(results.items()):
+                ranking = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in timings)
+                lines.append(f"{ext[1:].upper()}: {ranking or 'no working decoder'}")
+            self.status_var.set("Decoder benchmark complete")
+            self.root.after(0, lambda: messagebox.showinfo(
+                "Decoder Benchmark", "Decode time per frame, fastest first (now used):\n\n" + "\n".join(lines)))
         except Exception as e:
-            print(f"Preview update error: {str(e)}")
-            # Don't let preview errors crash the application
+            traceback.print_exc()
+            self.status_var.set(f"Error: {str(e)}")
+            CustomNotification(self.root, f"Decoder benchmark failed: {str(e)}", "error")
+        finally:
+            self.benchmark_button.config(state=tk.NORMAL)
+    
+    def show_analysis_results(self, results):
+        """Show analysis statistics and let the user exclude frames in bulk"""
+        window = tk.Toplevel(self.root)
+        window.title("Frame Analysis")
+        window.geometry("820x520")
+        window.transient(self.root)
+        
+        frame = ttk.Frame(window, padding=15)
+        frame.pack(fill=tk.BOTH, expand=True)
+        
+        flagged = [r["path"] for r in results if r["flags"]]
+        ttk.Label(frame, text=f"{len(flagged)} of {len(results)} frames flagged as outliers", 
+                 style="Heading.TLabel").pack(anchor=tk.W, pady=(0, 10))
+        
+        columns = ("brightness", "background", "streak", "status")
+        tree = ttk.Treeview(frame, columns=columns, selectmode="extended")
+        tree.heading("#0", text="File")
+        tree.heading("brightness", text="Brightness")
+        tree.heading("background", text="Sky Background")
+        tree.heading("streak", text="Streak %")
+        tree.heading("status", text="Flags")
+        tree.column("#0", width=220)
+        for column in ("brightness", "background", "streak"):
+            tree.column(column, width=100, anchor=tk.E)
+        tree.column("status", width=220)
+        
+        scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        
+        for r in results:
+            status = ", ".join(r["flags"])
+            if r["path"] in self.excluded_files:
+                status = "excluded" + (f" ({status})" if status else "")
+            tree.insert("", tk.END, iid=r["path"], text=os.path.basename(r["path"]), values=(
+                f"{r['brightness']:.1f}", f"{r['background']:.1f}", f"{r['streak'] * 100:.2f}", status))
+        # Frames already excluded (e.g. in the sequence strip) start selected too, so nothing is undone unseen
+        tree.selection_set(flagged + [r["path"] for r in results if r["path"] in self.excluded_files])
+        
+        button_frame = ttk.Frame(frame)
+        button_frame.pack(side=tk.BOTTOM, fill=tk.X, pady=(10, 0))
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        analyzed = {r["path"] for r in results}
+        
+        def exclude(paths, keep=()):
+            # Exclusions of frames outside this analysis are left as they are
+            self.excluded_files = (self.excluded_files | set(paths)) - set(keep)
+            CustomNotification(self.root, f"{len(self.excluded_files)} frames excluded from the stack", "info")
+            self.exclusions_changed()
+            window.destroy()
+        
+        ttk.Button(button_frame, text="Exclude Selected", style="Accent.TButton",
+                  command=lambda: exclude(tree.selection(), analyzed - set(tree.selection()))).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(button_frame, text="Exclude All Flagged",
+                  command=lambda: exclude(flagged)).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(button_frame, text="Keep Flagged Frames",
+                  command=lambda: exclude([], flagged)).pack(side=tk.RIGHT, padx=5)
     
     def process_images(self):
         if not self.image_files:
@@ -673,192 +3857,190 @@ For best results, use a tripod and consistent camera settings for all source ima
         
         # Disable button during processing
         self.process_button.config(state=tk.DISABLED)
-        self.progress['value'] = 0
+        self.set_progress(0)
+        
+        # Fresh pause/cancel signals for this run; the previous stack can no longer be re-stacked
+        self.run_control = RunControl()
+        self.restack_pipeline = None
+        self.set_range_pipeline(None)
+        self.pause_button.config(state=tk.NORMAL, text="Pause")
+        self.cancel_button.config(state=tk.NORMAL)
         
         # Start processing in a separate thread
         threading.Thread(target=self._process_thread, daemon=True).start()
     
-    def read_image(self, img_path):
-        """Read an image file, handling both regular formats and ARW raw files"""
+    def set_progress(self, value):
+        """Show a run's progress in percent, or a busy indicator when it is unknown (None)"""
+        if value is None:
+            if str(self.progress.cget("mode")) != "indeterminate":
+                self.progress.config(mode="indeterminate")
+                self.progress.start(20)
+        else:
+            if str(self.progress.cget("mode")) != "determinate":
+                self.progress.stop()
+                self.progress.config(mode="determinate")
+            self.progress.config(value=value)
+    
+    def get_memory_budget(self):
+        """Return the configured memory budget in GB, 0 meaning auto-detect"""
         try:
-            if img_path.lower().endswith('.arw'):
-                # Handle ARW (Sony RAW) file
-                self.status_var.set(f"Processing RAW file: {os.path.basename(img_path)}")
-                with rawpy.imread(img_path) as raw:
-                    # Get RAW processing options from the UI
-                    use_camera_wb = self.use_camera_wb.get()
-                    no_auto_bright = self.no_auto_bright.get()
-                    
-                    # Process the raw data to get an RGB image with user-specified parameters
-                    rgb = raw.postprocess(
-                        use_camera_wb=use_camera_wb,
-                        half_size=False,  # Full resolution
-                        no_auto_bright=no_auto_bright,
-                        bright=1.0,  # Default brightness
-                        highlight_mode=rawpy.HighlightMode.Clip  # Preserve highlights
-                    )
-                    # Convert from RGB to BGR for OpenCV compatibility
-                    return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR).astype(np.float32)
-            else:
-                # Handle regular image formats
-                img = cv2.imread(img_path)
-                if img is None:
-                    raise IOError(f"Could not read image file: {img_path}")
-                return img.astype(np.float32)
+            return max(0.0, float(self.memory_budget_gb.get()))
+        except (tk.TclError, ValueError):
+            return 0.0
+    
+    def collect_options(self):
+        """Snapshot the current UI settings as stacking job options"""
+        try:
+            comet_length = int(self.comet_length.get())
+        except ValueError:
+            comet_length = 30  # Default if invalid input
+        
+        gap_size = 0
+        if self.fill_gaps.get():
+            try:
+                gap_size = int(self.gap_size.get())
+            except ValueError:
+                gap_size = 2  # Default if invalid input
+        
+        try:
+            gif_duration = int(self.gif_duration.get())
+        except ValueError:
+            gif_duration = 50  # Default if invalid input
+        
+        try:
+            foreground_fraction = float(self.foreground_percent.get()) / 100
+        except ValueError:
+            foreground_fraction = 0.35  # Default if invalid input
+        
+        try:
+            video_stride = max(1, int(self.video_stride.get()))
+            video_start = max(0.0, float(self.video_start.get()))
+            video_end = max(0.0, float(self.video_end.get()))
+        except ValueError:
+            video_stride, video_start, video_end = 1, 0.0, 0.0  # Whole video if invalid input
+        
+        top_k = 0
+        if self.instant_exclusion.get():
+            try:
+                top_k = min(max(int(self.top_k_depth.get()), 1), 16)
+            except ValueError:
+                top_k = 4  # Default if invalid input
+        
+        range_blocks = 0
+        if self.trail_range.get():
+            try:
+                range_blocks = min(max(int(self.range_blocks.get()), 2), 256)
+            except ValueError:
+                range_blocks = 16  # Default if invalid input
+        
+        return {
+            "image_filename": self.image_filename.get(),
+            "output_format": self.output_format.get(),
+            "trail_style": self.trail_style.get(),
+            "comet_length": comet_length,
+            "gap_size": gap_size,
+            "use_camera_wb": self.use_camera_wb.get(),
+            "no_auto_bright": self.no_auto_bright.get(),
+            "use_darks": self.use_darks.get(),
+            "dark_folder": self.dark_entry.get().strip(),
+            "generate_gif": self.generate_gif.get(),
+            "gif_filename": self.gif_filename.get(),
+            "gif_duration": gif_duration,
+            "excluded": sorted(self.excluded_files),
+            "memory_budget_gb": self.get_memory_budget(),
+            "extra_tiff": self.extra_tiff.get(),
+            "web_jpeg": self.web_jpeg.get(),
+            "thumbnail": self.thumbnail.get(),
+            "align_frames": self.align_frames.get(),
+            "foreground_fraction": foreground_fraction,
+            "video_stride": video_stride,
+            "video_start": video_start,
+            "video_end": video_end,
+            "top_k": top_k,
+            "range_blocks": range_blocks,
+        }
+    
+    def toggle_pause(self):
+        if self.run_control is None:
+            return
+        if self.run_control.paused:
+            self.run_control.resume()
+            self.pause_button.config(text="Pause")
+            self.status_var.set("Resuming...")
+        else:
+            self.run_control.pause()
+            self.pause_button.config(text="Resume")
+            self.status_var.set("Paused")
+    
+    def cancel_processing(self):
+        if self.run_control is None:
+            return
+        self.run_control.cancel()
+        self.pause_button.config(state=tk.DISABLED, text="Pause")
+        self.cancel_button.config(state=tk.DISABLED)
+        self.status_var.set("Cancelling...")
+    
+    def offer_partial_save(self, pipeline):
+        """Offer to save whatever was stacked before the run was cancelled"""
+        if pipeline.output_path:
+            self.status_var.set(f"GIF cancelled. Star trail image saved to {self.output_folder}")
+            CustomNotification(self.root, "GIF creation cancelled", "warning")
+            return
+        if pipeline.partial_image is None:
+            self.status_var.set("Cancelled")
+            CustomNotification(self.root, "Processing cancelled", "warning")
+            return
+        
+        stacked = f"{pipeline.frames_stacked} of {pipeline.total_frames} images"
+        if not pipeline.total_frames:
+            stacked = f"{pipeline.frames_stacked} frames"  # A video of unknown length
+        self.final_image = pipeline.partial_image
+        self.status_var.set(f"Cancelled after {stacked}")
+        if not messagebox.askyesno("Processing Cancelled",
+                                   f"Stacking was cancelled after {stacked}.\n\n"
+                                   f"Save the partial star trail?"):
+            return
+        
+        base_name, extension = os.path.splitext(pipeline.options["image_filename"])
+        pipeline.options["image_filename"] = f"{base_name}_partial{extension}"
+        pipeline.final_image = pipeline.partial_image
+        try:
+            output_path = pipeline.save_image()
+            self.status_var.set(f"Partial star trail saved to {output_path}")
+            CustomNotification(self.root, "Partial star trail saved", "success")
         except Exception as e:
-            self.status_var.set(f"Error reading {os.path.basename(img_path)}: {str(e)}")
-            traceback.print_exc()
-            # Return a black image of default size as fallback
-            return np.zeros((1080, 1920, 3), dtype=np.float32)
-
+            self.status_var.set(f"Error: {str(e)}")
+            CustomNotification(self.root, f"Could not save the partial star trail: {str(e)}", "error")
+    
     def _process_thread(self):
+        pipeline = None
         try:
-            self.status_var.set("Reading images...")
+            job = StackJob(self.image_folder, self.output_folder, self.collect_options(),
+                           image_files=self.image_files)
+            pipeline = StackPipeline(
+                job,
+                on_status=self.status_var.set,
+                on_progress=self.set_progress,
+                on_preview=self.update_preview,
+                on_notify=lambda message, type_: CustomNotification(self.root, message, type_),
+                control=self.run_control)
+            self.final_image = pipeline.run()
             
-            if not self.image_files:
-                raise ValueError("No image files found in the selected folder")
-                
-            # Read the first image as base
-            base_img = self.read_image(self.image_files[0])
-            self.progress['value'] = 1
-            
-            # Update preview with first image
-            first_img_preview = base_img.copy().astype(np.uint8)
-            self.root.after(0, lambda: self.update_preview(first_img_preview))
-            self.root.update_idletasks()
-            
-            # Stack images using maximum pixel value
-            total_images = len(self.image_files)
-            for i, img_path in enumerate(self.image_files[1:], 1):
-                try:
-                    img = self.read_image(img_path)
-                    base_img = np.maximum(base_img, img)  # Keep the brightest pixels
-                    
-                    # Update progress bar
-                    progress_value = int((i / total_images) * 100)
-                    self.progress['value'] = progress_value
-                    self.status_var.set(f"Processing image {i}/{total_images} ({progress_value}%)")
-                    
-                    # Update preview periodically (every 5 images or final image)
-                    if i % 5 == 0 or i == len(self.image_files) - 1:
-                        current_preview = np.uint8(base_img.copy())
-                        self.root.after(0, lambda img=current_preview: self.update_preview(img))
-                    
-                    self.root.update_idletasks()
-                except Exception as e:
-                    # Log the error but continue processing other images
-                    error_msg = f"Error processing {os.path.basename(img_path)}: {str(e)}"
-                    print(error_msg)
-                    self.status_var.set(error_msg)
-                    traceback.print_exc()
+            # Keep a maximum stack's top-K values so later exclusions apply instantly
+            self.restack_pipeline = pipeline if pipeline.top_k is not None else None
+            self.stacked_excluded = set(job.options["excluded"])
+            self.set_range_pipeline(pipeline if pipeline.range_tree is not None else None)
             
-            # Convert back to 8-bit image format
-            self.final_image = np.uint8(base_img)
-            
-            # Save the output image
-            output_path = os.path.join(self.output_folder, self.image_filename.get())
-            
-            # Update preview with final image
-            self.root.after(0, lambda: self.update_preview(self.final_image))
-
-            # Ensure the correct extension is added
-            chosen_format = self.output_format.get()
-            if chosen_format == "JPEG":
-                if not output_path.lower().endswith(('.jpg', '.jpeg')):
-                    output_path += '.jpg'
-                # Save as JPEG with 100% quality
-                cv2.imwrite(output_path, self.final_image, [cv2.IMWRITE_JPEG_QUALITY, 100])
-            elif chosen_format == "TIFF":
-                if not output_path.lower().endswith(('.tif', '.tiff')):
-                    output_path += '.tiff'
-                # Save as TIFF (16-bit for better quality)
-                final_img_16bit = np.uint16(self.final_image) * 256  # Convert 8-bit to 16-bit
-                cv2.imwrite(output_path, final_img_16bit)
-            elif chosen_format == "DNG":
-                if not output_path.lower().endswith('.dng'):
-                    output_path += '.dng'
-                # For DNG format, we need specialized handling
-                try:
-                    # Try to use imageio for DNG
-                    import imageio
-                    # Convert to RGB for proper DNG handling
-                    rgb_image = cv2.cvtColor(self.final_image, cv2.COLOR_BGR2RGB)
-                    imageio.imwrite(output_path, rgb_image)
-                except (ImportError, Exception) as e:
-                    # Fallback to TIFF if DNG handling fails
-                    output_path = output_path.replace('.dng', '.tiff')
-                    final_img_16bit = np.uint16(self.final_image) * 256
-                    cv2.imwrite(output_path, final_img_16bit)
-                    CustomNotification(self.root, f"DNG format failed, saved as TIFF instead. Error: {str(e)}", "warning")
-            
-            # Create GIF if enabled
-            if self.generate_gif.get():
-                self.root.after(0, lambda: self.status_var.set("Creating GIF..."))
-                gif_path = os.path.join(self.output_folder, self.gif_filename.get())
-
-                try:
-                    duration = int(self.gif_duration.get())
-                except ValueError:
-                    duration = 50  # Default if invalid input
-
-                # Define a reasonable max size for GIF frames to reduce memory usage
-                max_gif_dimension = 1920  # Maximum width or height
-
-                # Process images one at a time to reduce memory usage
-                pil_images = []
-                total_gif_images = len(self.image_files)
-
-                for idx, img_path in enumerate(self.image_files):
-                    try:
-                        # Update status
-                        self.root.after(0, lambda i=idx: self.status_var.set(f"Processing GIF frame {i+1}/{total_gif_images}..."))
-
-                        # Open and resize image
-                        img = Image.open(img_path)
-
-                        # Resize if image is too large
-                        if max(img.size) > max_gif_dimension:
-                            ratio = max_gif_dimension / max(img.size)
-                            new_size = tuple(int(dim * ratio) for dim in img.size)
-                            img = img.resize(new_size, Image.Resampling.LANCZOS)
-
-                        # Convert to RGB if needed (for consistency)
-                        if img.mode != 'RGB':
-                            img = img.convert('RGB')
-
-                        pil_images.append(img)
-
-                    except Exception as e:
-                        self.root.after(0, lambda e=e, path=img_path:
-                            self.status_var.set(f"Warning: Could not open {os.path.basename(path)}: {str(e)}"))
-                        continue
-
-                if pil_images:
-                    self.root.after(0, lambda: self.status_var.set("Saving GIF..."))
-                    pil_images[0].save(
-                        gif_path,
-                        save_all=True,
-                        append_images=pil_images[1:],
-                        duration=duration,
-                        loop=0,
-                        optimize=False  # Disable optimization to speed up saving
-                    )
-
-                    # Clean up memory
-                    for img in pil_images:
-                        img.close()
-                    pil_images.clear()
-
-                    self.root.after(0, lambda: self.status_var.set(f"Completed! Files saved to {self.output_folder}"))
-                    CustomNotification(self.root, f"Star trail and GIF created successfully!", "success")
-                else:
-                    self.root.after(0, lambda: self.status_var.set("Error: No valid images found for GIF creation"))
-                    CustomNotification(self.root, "Could not create GIF: No valid images found", "error")
-            else:
-                # Skip GIF creation
+            if pipeline.gif_path:
+                self.status_var.set(f"Completed! Files saved to {self.output_folder}")
+                CustomNotification(self.root, f"Star trail and GIF created successfully!", "success")
+            elif not job.options["generate_gif"]:
                 self.status_var.set(f"Completed! Star trail image saved to {self.output_folder}")
                 CustomNotification(self.root, f"Star trail image created successfully!", "success")
             
+        except StackCancelled:
+            self.root.after(0, lambda: self.offer_partial_save(pipeline))
+        
         except Exception as e:
             self.status_var.set(f"Error: {str(e)}")
             CustomNotification(self.root, f"An error occurred: {str(e)}", "error")
@@ -866,6 +4048,10 @@ For best results, use a tripod and consistent camera settings for all source ima
         finally:
             # Re-enable button
             self.process_button.config(state=tk.NORMAL)
+            if str(self.progress.cget("mode")) == "indeterminate":
+                self.set_progress(0)  # Stop the busy indicator of a video without a known length
+            self.pause_button.config(state=tk.DISABLED, text="Pause")
+            self.cancel_button.config(state=tk.DISABLED)
 
 def main():
     root = tk.Tk()